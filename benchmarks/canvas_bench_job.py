@@ -0,0 +1,57 @@
+"""
+The canvas graph as a job wired to the local stand-ins
+of local_resources, for run_scenarios to execute with
+the multiprocess executor. Every step records its peak
+RSS to the file named by CANVAS_BENCH_PEAK_RSS_PATH.
+
+Importing jobs.canvas reads SCHOOL_YEAR_START_DATE
+from the environment, which run_scenarios sets.
+"""
+import json
+import os
+import resource
+
+from dagster import fs_io_manager, multiprocess_executor, success_hook
+from jobs.canvas import canvas
+from local_resources import local_dbt, local_gcs_client, local_warehouse
+from resources.canvas_api_resource import canvas_api_resource_client
+from resources.extract_io_manager import extract_io_manager
+
+
+@success_hook
+def record_peak_rss(context):
+    """
+    Append the peak resident set size of the
+    step's process, in kilobytes, to the peak
+    RSS file. Each step runs in its own process.
+    """
+    path = os.getenv("CANVAS_BENCH_PEAK_RSS_PATH")
+    if not path:
+        return
+    line = json.dumps({
+        "step_key": context.step_key,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    })
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+
+def make_canvas_bench_job():
+    """
+    Return the benchmark job. reconstructable needs
+    a module scoped function to rebuild a to_job
+    job in each step's process.
+    """
+    return canvas.to_job(
+        name="canvas_bench",
+        executor_def=multiprocess_executor,
+        resource_defs={
+            "file_manager": local_gcs_client,
+            "io_manager": fs_io_manager,
+            "extract_io_manager": extract_io_manager,
+            "canvas_api_client": canvas_api_resource_client,
+            "warehouse": local_warehouse,
+            "dbt": local_dbt
+        },
+        hooks={record_peak_rss}
+    )
@@ -0,0 +1,473 @@
+"""
+Local mock of the Canvas REST API serving a synthetic
+district, so the extract hot paths can be benchmarked
+offline. Every endpoint the canvas job calls is served
+with numbered Link header pagination, X-Rate-Limit-Remaining
+and X-Request-Cost headers from a leaky bucket, ETags, 404s
+for deleted assignments and quiz submissions.
+
+    python benchmarks/canvas_mock_server.py --courses-per-term 50
+
+Records are generated from the district's seed and their
+ids, so every request for a page returns the same body.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit
+
+# ids of each entity type are offset so they
+# never collide across types
+TERM_ID_OFFSET = 1000
+COURSE_ID_OFFSET = 100000
+SECTION_ID_OFFSET = 1000000
+ASSIGNMENT_ID_OFFSET = 10000000
+USER_ID_OFFSET = 100000000
+
+
+@dataclass
+class District:
+    """Size of the synthetic district served"""
+    terms: int = 2
+    courses_per_term: int = 20
+    min_students: int = 5
+    max_students: int = 60
+    sections_per_course: int = 2
+    assignments_per_course: int = 25
+    quiz_fraction: float = 0.2
+    deleted_fraction: float = 0.02
+    seed: int = 0
+
+
+@dataclass
+class RateLimit:
+    """Leaky bucket Canvas throttles a token with"""
+    capacity: float = 700.0
+    leak_per_second: float = 10.0
+    request_cost: float = 1.0
+    latency: float = 0.0
+
+
+class SyntheticCanvas:
+    """
+    Generates the records of a district on demand
+    and keeps the rate limit bucket and request
+    stats of the server.
+    """
+
+    def __init__(self, district: District, rate_limit: RateLimit):
+        self.district = district
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.bucket_level = 0.0
+        self.bucket_updated = time.monotonic()
+        self.requests = defaultdict(int)
+        self.response_bytes = defaultdict(int)
+        self.pages = defaultdict(int)
+        self.status_counts = defaultdict(int)
+
+
+    def _rng(self, *key) -> random.Random:
+        return random.Random(f"{self.district.seed}:{':'.join(str(k) for k in key)}")
+
+
+    def spend(self, endpoint: str) -> Tuple[bool, float, float]:
+        """
+        Charge a request to the bucket and return whether
+        it is allowed, the remaining capacity and its cost.
+        """
+        cost = self.rate_limit.request_cost
+        with self.lock:
+            now = time.monotonic()
+            self.bucket_level = max(
+                0.0,
+                self.bucket_level - (now - self.bucket_updated) * self.rate_limit.leak_per_second
+            )
+            self.bucket_updated = now
+            self.requests[endpoint] += 1
+            if self.bucket_level + cost > self.rate_limit.capacity:
+                return False, self.rate_limit.capacity - self.bucket_level, cost
+            self.bucket_level += cost
+            return True, self.rate_limit.capacity - self.bucket_level, cost
+
+
+    def record_response(self, endpoint: str, status: int, size: int):
+        with self.lock:
+            self.status_counts[status] += 1
+            self.response_bytes[endpoint] += size
+            if status in (200, 304):
+                self.pages[endpoint] += 1
+
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "pages": dict(self.pages),
+                "response_bytes": dict(self.response_bytes),
+                "status_counts": {str(k): v for k, v in self.status_counts.items()}
+            }
+
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+            self.response_bytes.clear()
+            self.pages.clear()
+            self.status_counts.clear()
+
+
+    def terms(self) -> List[Dict]:
+        return [
+            {
+                "id": TERM_ID_OFFSET + i,
+                "name": f"Term {i + 1}",
+                "sis_term_id": f"T{i + 1}",
+                "start_at": f"2021-{8 + i % 5:02d}-01T05:00:00Z",
+                "end_at": f"2022-{1 + i % 5:02d}-01T05:00:00Z",
+                "workflow_state": "active"
+            }
+            for i in range(self.district.terms)
+        ]
+
+
+    def course_ids(self, term_id: int) -> List[int]:
+        first = COURSE_ID_OFFSET + (term_id - TERM_ID_OFFSET) * self.district.courses_per_term
+        return list(range(first, first + self.district.courses_per_term))
+
+
+    def student_ids(self, course_id: int) -> List[int]:
+        count = self._rng("students", course_id).randint(
+            self.district.min_students, self.district.max_students)
+        return [USER_ID_OFFSET + course_id * 1000 + i for i in range(count)]
+
+
+    def courses(self, term_id: int) -> List[Dict]:
+        return [
+            {
+                "id": course_id,
+                "name": f"Course {course_id}",
+                "course_code": f"C{course_id}",
+                "sis_course_id": f"SIS-{course_id}",
+                "enrollment_term_id": term_id,
+                "total_students": len(self.student_ids(course_id)),
+                "workflow_state": "available",
+                "start_at": None,
+                "end_at": None,
+                "term": {"id": term_id, "name": f"Term {term_id - TERM_ID_OFFSET + 1}"},
+                "teachers": [{"id": USER_ID_OFFSET + course_id, "display_name": "Teacher"}]
+            }
+            for course_id in self.course_ids(term_id)
+        ]
+
+
+    def sections(self, course_id: int) -> List[Dict]:
+        students = len(self.student_ids(course_id))
+        count = self.district.sections_per_course
+        return [
+            {
+                "id": SECTION_ID_OFFSET + course_id * 10 + i,
+                "course_id": course_id,
+                "sis_section_id": f"SEC-{course_id}-{i}",
+                "sis_course_id": f"SIS-{course_id}",
+                "name": f"Section {i + 1}",
+                "total_students": students // count,
+                "restrict_enrollments_to_section_dates": False,
+                "start_at": None,
+                "end_at": None,
+                "created_at": "2021-08-01T00:00:00Z"
+            }
+            for i in range(count)
+        ]
+
+
+    def enrollments(self, course_id: int) -> List[Dict]:
+        sections = self.sections(course_id)
+        return [
+            {
+                "id": user_id * 10,
+                "user_id": user_id,
+                "course_id": course_id,
+                "course_section_id": sections[i % len(sections)]["id"],
+                "type": "StudentEnrollment",
+                "role": "StudentEnrollment",
+                "enrollment_state": "active",
+                "created_at": "2021-08-01T00:00:00Z",
+                "updated_at": "2021-08-01T00:00:00Z",
+                "grades": {"current_points": self._rng("points", user_id).randint(0, 1000)}
+            }
+            for i, user_id in enumerate(self.student_ids(course_id))
+        ]
+
+
+    def assignments(self, course_id: int) -> List[Dict]:
+        assignments = list()
+        for i in range(self.district.assignments_per_course):
+            assignment_id = ASSIGNMENT_ID_OFFSET + course_id * 100 + i
+            is_quiz = self._rng("quiz", assignment_id).random() < self.district.quiz_fraction
+            assignments.append({
+                "id": assignment_id,
+                "course_id": course_id,
+                "name": f"Assignment {i + 1}",
+                "description": "<p>" + "Lorem ipsum dolor sit amet. " * 8 + "</p>",
+                "due_at": f"2021-{9 + i % 4:02d}-{1 + i % 28:02d}T05:59:59Z",
+                "points_possible": 10.0,
+                "is_quiz_assignment": is_quiz,
+                "quiz_id": assignment_id if is_quiz else None,
+                "workflow_state": "published",
+                "created_at": "2021-08-01T00:00:00Z",
+                "updated_at": f"2021-{9 + i % 4:02d}-{1 + i % 28:02d}T00:00:00Z"
+            })
+        return assignments
+
+
+    def is_deleted(self, assignment_id: int) -> bool:
+        return self._rng("deleted", assignment_id).random() < self.district.deleted_fraction
+
+
+    def _course_of_assignment(self, assignment_id: int) -> int:
+        return (assignment_id - ASSIGNMENT_ID_OFFSET) // 100
+
+
+    def submissions(self, assignment_id: int) -> List[Dict]:
+        course_id = self._course_of_assignment(assignment_id)
+        submissions = list()
+        for user_id in self.student_ids(course_id):
+            rng = self._rng("submission", assignment_id, user_id)
+            graded = rng.random() < 0.8
+            score = round(rng.uniform(0, 10), 1) if graded else None
+            submissions.append({
+                "id": assignment_id * 1000 + user_id % 1000,
+                "assignment_id": assignment_id,
+                "user_id": user_id,
+                "grader_id": USER_ID_OFFSET + course_id if graded else None,
+                "grading_period_id": None,
+                "grade": str(score) if graded else None,
+                "score": score,
+                "entered_grade": str(score) if graded else None,
+                "entered_score": score,
+                "submitted_at": "2021-10-01T12:00:00Z",
+                "graded_at": "2021-10-02T12:00:00Z" if graded else None,
+                "posted_at": "2021-10-02T12:00:00Z" if graded else None,
+                "submission_type": "online_text_entry",
+                "grade_matches_current_submission": True,
+                "late": rng.random() < 0.1,
+                "missing": rng.random() < 0.05,
+                "workflow_state": "graded" if graded else "submitted"
+            })
+        return submissions
+
+
+    def quiz_submissions(self, quiz_id: int) -> Dict:
+        return {
+            "quiz_submissions": [
+                {
+                    "id": submission["id"],
+                    "quiz_id": quiz_id,
+                    "user_id": submission["user_id"],
+                    "submission_id": submission["id"],
+                    "score": submission["score"],
+                    "kept_score": submission["score"],
+                    "started_at": submission["submitted_at"],
+                    "finished_at": submission["submitted_at"],
+                    "workflow_state": "complete"
+                }
+                for submission in self.submissions(quiz_id)
+            ]
+        }
+
+
+    def student_submissions(self, course_id: int, assignment_ids: List[int],
+        since: Optional[str]) -> List[Dict]:
+        assignments = assignment_ids or [
+            assignment["id"] for assignment in self.assignments(course_id)]
+        return [
+            submission
+            for assignment_id in assignments if not self.is_deleted(assignment_id)
+            for submission in self.submissions(assignment_id)
+            if since is None
+            or max(submission["submitted_at"], submission["graded_at"] or "") > since
+        ]
+
+
+# routes of the API paths the canvas job calls,
+# matched to the endpoint name requests are counted by
+ROUTES = [
+    ("terms", re.compile(r"^/api/v1/accounts/\w+/terms$")),
+    ("courses", re.compile(r"^/api/v1/accounts/\w+/courses$")),
+    ("assignments", re.compile(r"^/api/v1/courses/(?P<course_id>\d+)/assignments$")),
+    ("enrollments", re.compile(r"^/api/v1/courses/(?P<course_id>\d+)/enrollments$")),
+    ("sections", re.compile(r"^/api/v1/courses/(?P<course_id>\d+)/sections$")),
+    ("submissions", re.compile(
+        r"^/api/v1/courses/(?P<course_id>\d+)/assignments/(?P<assignment_id>\d+)/submissions$")),
+    ("quiz_submissions", re.compile(
+        r"^/api/v1/courses/(?P<course_id>\d+)/quizzes/(?P<quiz_id>\d+)/submissions$")),
+    ("students_submissions", re.compile(r"^/api/v1/courses/(?P<course_id>\d+)/students/submissions$"))
+]
+
+
+class CanvasHandler(BaseHTTPRequestHandler):
+    """Serves the synthetic district of the server's canvas"""
+
+    protocol_version = "HTTP/1.1"
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_GET(self):
+        canvas: SyntheticCanvas = self.server.canvas
+        url = urlsplit(self.path)
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return self._send(None, 404, {"errors": [{"message": "not found"}]})
+
+        allowed, remaining, cost = canvas.spend(endpoint)
+        headers = {
+            "X-Rate-Limit-Remaining": f"{remaining:.3f}",
+            "X-Request-Cost": f"{cost:.3f}"
+        }
+        if canvas.rate_limit.latency:
+            time.sleep(canvas.rate_limit.latency)
+        if not allowed:
+            return self._send(endpoint, 403, "403 Forbidden (Rate Limit Exceeded)", headers)
+
+        query = parse_qs(url.query)
+        body = self._records(canvas, endpoint, match.groupdict(), query)
+        if body is None:
+            return self._send(endpoint, 404, {"errors": [{"message": "not found"}]}, headers)
+        if isinstance(body, list):
+            body, link = self._paginate(url, body, query)
+            headers["Link"] = link
+        self._send(endpoint, 200, body, headers)
+
+
+    def _records(self, canvas: SyntheticCanvas, endpoint: str,
+        params: Dict, query: Dict):
+        """
+        Return the body of an endpoint, a list
+        for paginated endpoints, or None for a 404.
+        """
+        if endpoint == "terms":
+            return {"enrollment_terms": canvas.terms()}
+        elif endpoint == "courses":
+            return canvas.courses(int(query["enrollment_term_id"][0]))
+        elif endpoint in ("assignments", "enrollments", "sections"):
+            return getattr(canvas, endpoint)(int(params["course_id"]))
+        elif endpoint == "submissions":
+            assignment_id = int(params["assignment_id"])
+            return None if canvas.is_deleted(assignment_id) else canvas.submissions(assignment_id)
+        elif endpoint == "quiz_submissions":
+            quiz_id = int(params["quiz_id"])
+            return None if canvas.is_deleted(quiz_id) else canvas.quiz_submissions(quiz_id)
+
+        since = query.get("submitted_since", query.get("graded_since", [None]))[0]
+        return canvas.student_submissions(
+            int(params["course_id"]),
+            [int(id) for id in query.get("assignment_ids[]", list())],
+            since
+        )
+
+
+    def _paginate(self, url, records: List, query: Dict) -> Tuple[List, str]:
+        """
+        Return a page of records and the
+        Link header of numbered pages.
+        """
+        per_page = int(query.get("per_page", ["10"])[0])
+        page = int(query.get("page", ["1"])[0])
+        last_page = max(1, -(-len(records) // per_page))
+        base = f"http://{self.headers['Host']}{url.path}"
+        params = parse_qsl(url.query)
+
+        def page_url(number):
+            page_params = [(k, v) for k, v in params if k != "page"] + [("page", str(number))]
+            return f"{base}?{urlencode(page_params)}"
+
+        links = [f'<{page_url(page)}>; rel="current"']
+        if page < last_page:
+            links.append(f'<{page_url(page + 1)}>; rel="next"')
+        links.append(f'<{page_url(1)}>; rel="first"')
+        links.append(f'<{page_url(last_page)}>; rel="last"')
+        return records[(page - 1) * per_page:page * per_page], ",".join(links)
+
+
+    def _send(self, endpoint: Optional[str], status: int, body, headers: Dict = None):
+        content = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, content = 304, b""
+
+        self.send_response(status)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        if endpoint is not None:
+            self.server.canvas.record_response(endpoint, status, len(content))
+
+
+class MockCanvasServer(ThreadingHTTPServer):
+    """Threaded HTTP server of a synthetic district"""
+
+    daemon_threads = True
+
+
+    def __init__(self, canvas: SyntheticCanvas, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), CanvasHandler)
+        self.canvas = canvas
+
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def start(self) -> "MockCanvasServer":
+        """
+        Serve on a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8900)
+    for name, default in vars(District()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    for name, default in vars(RateLimit()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = vars(parser.parse_args())
+
+    canvas = SyntheticCanvas(
+        District(**{name: args[name] for name in vars(District())}),
+        RateLimit(**{name: args[name] for name in vars(RateLimit())})
+    )
+    server = MockCanvasServer(canvas, port=args["port"])
+    print(f"Serving a synthetic Canvas district on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(canvas.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
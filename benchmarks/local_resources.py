@@ -0,0 +1,202 @@
+"""
+Local stand-ins for the cloud resources of the canvas
+job, so it can run end to end offline. GCS objects are
+written to a directory through the subset of the
+google.cloud.storage API GcsClient calls, the warehouse
+records the tables it would create and load, and dbt
+is not run.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+from dagster import Field, resource
+from resources.gcs_resource import GcsClient
+
+
+class LocalBlob:
+    """Object of a LocalBucket, stored as a file"""
+
+    def __init__(self, bucket: "LocalBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.directory, name)
+
+
+    def upload_from_string(self, data, content_type: str = None, num_retries: int = 0):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+    def download_as_bytes(self) -> bytes:
+        from google.cloud import exceptions
+
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise exceptions.NotFound(self.name)
+
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class LocalBucket:
+    """Bucket whose objects are files under a directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self, name)
+
+
+    def list_blobs(self, prefix: str = "") -> List[LocalBlob]:
+        blobs = list()
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                if file_name.endswith(".tmp"):
+                    continue
+                name = os.path.relpath(os.path.join(root, file_name), self.directory)
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(self, name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+class LocalStorageClient:
+    """Stand-in for google.cloud.storage.Client"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+
+    def get_bucket(self, bucket_name: str) -> LocalBucket:
+        directory = os.path.join(self.directory, bucket_name)
+        os.makedirs(directory, exist_ok=True)
+        return LocalBucket(directory)
+
+
+    @contextmanager
+    def batch(self):
+        yield
+
+
+class LocalGcsClient(GcsClient):
+    """GcsClient writing its objects to a local directory"""
+
+    def __init__(self, directory, gcs_bucket, gcs_prefix, **kwargs):
+        super().__init__(
+            gcs_bucket, gcs_prefix, client=LocalStorageClient(directory), **kwargs)
+
+
+class LocalWarehouse:
+    """
+    Stand-in for BigQueryClient recording each table's
+    source URIs and loads in a JSON file, so steps in
+    other processes see the same tables.
+    """
+
+    def __init__(self, directory: str, load_mode: str = "external"):
+        self.path = os.path.join(directory, "warehouse.json")
+        self.load_mode = load_mode
+        os.makedirs(directory, exist_ok=True)
+
+
+    def _read(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+
+
+    def _update(self, table_name: str, **fields):
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            tables = self._read()
+            tables.setdefault(table_name, dict()).update(fields)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(tables, f)
+            os.replace(tmp_path, self.path)
+
+
+    def create_table(self, schema: List, external_config, table_name: str) -> str:
+        self._update(table_name, source_uris=list(external_config.source_uris))
+        return table_name
+
+
+    def get_source_uris(self, table_name: str) -> List[str]:
+        return list(self._read().get(table_name, dict()).get("source_uris", list()))
+
+
+    def update_source_uris(self, table_name: str, source_uris: List[str]) -> str:
+        self._update(table_name, source_uris=source_uris)
+        return table_name
+
+
+    def load_table(self, table_name: str, source_uris: List[str], **kwargs) -> str:
+        self._update(table_name, loaded_uris=source_uris, merge_key=kwargs.get("merge_key"))
+        return table_name
+
+
+class DbtResult:
+    """Result of a dbt run that was not executed"""
+    result = dict()
+    return_code = 0
+
+
+class LocalDbt:
+    """Stand-in for the dbt resource skipping dbt runs"""
+
+    def run(self, models: List[str] = None, **kwargs) -> DbtResult:
+        return DbtResult()
+
+
+@resource(
+    config_schema={
+        "directory": str,
+        "gcs_bucket": str,
+        "gcs_prefix": str,
+        "compress": Field(bool, default_value=True),
+        "chunk_size_bytes": Field(int, default_value=64 * 1024 * 1024),
+        "upload_concurrency": Field(int, default_value=4),
+        "landing_format": Field(str, default_value="json")
+    },
+    description="GCS client writing to a local directory",
+)
+def local_gcs_client(context):
+    client = LocalGcsClient(**context.resource_config)
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+@resource(
+    config_schema={
+        "directory": str,
+        "load_mode": Field(str, default_value="external")
+    },
+    description="Warehouse recording tables in a local file",
+)
+def local_warehouse(context):
+    return LocalWarehouse(**context.resource_config)
+
+
+@resource(description="dbt resource that does not run dbt")
+def local_dbt(context):
+    return LocalDbt()
@@ -0,0 +1,253 @@
+"""
+Run the canvas job end to end against a mock Canvas
+server and local GCS and warehouse stand-ins, and report
+the wall time, requests/sec, pages, bytes and peak RSS of
+each stage.
+
+    python benchmarks/run_scenarios.py --scenario small medium
+
+Run it before and after a change to compare. Stages are
+the job's ops, with the steps of mapped ops combined.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BENCHMARKS_DIR, "..", "project")
+
+# step subprocesses import the job from these directories
+sys.path[:0] = [PROJECT_DIR, BENCHMARKS_DIR]
+os.environ["PYTHONPATH"] = os.pathsep.join(
+    [PROJECT_DIR, BENCHMARKS_DIR] + [p for p in [os.getenv("PYTHONPATH")] if p])
+# read by jobs.canvas when the job is imported, the
+# scenarios configure term_id_generator themselves
+os.environ.setdefault("SCHOOL_YEAR_START_DATE", "2021-01-01")
+
+from canvas_mock_server import District, MockCanvasServer, RateLimit, SyntheticCanvas
+
+# district, rate limit and op config of each scenario
+SCENARIOS = {
+    "small": {
+        "district": {"terms": 1, "courses_per_term": 10},
+        "rate_limit": {},
+        "ops": {"batch_size": 5, "bulk": True}
+    },
+    "medium": {
+        "district": {"terms": 2, "courses_per_term": 100},
+        "rate_limit": {},
+        "ops": {"batch_size": 25, "bulk": True}
+    },
+    "large": {
+        "district": {"terms": 2, "courses_per_term": 500, "max_students": 150},
+        "rate_limit": {},
+        "ops": {"batch_size": 50, "bulk": True}
+    },
+    "per_assignment": {
+        "district": {"terms": 1, "courses_per_term": 50},
+        "rate_limit": {},
+        "ops": {"batch_size": 10, "bulk": False}
+    },
+    "throttled": {
+        "district": {"terms": 1, "courses_per_term": 50},
+        "rate_limit": {"capacity": 200.0, "leak_per_second": 50.0, "latency": 0.02},
+        "ops": {"batch_size": 10, "bulk": True}
+    }
+}
+
+# extract stage that requests each mock server endpoint
+ENDPOINT_STAGES = {
+    "terms": "get_terms",
+    "courses": "get_courses",
+    "assignments": "get_assignments",
+    "enrollments": "get_enrollments",
+    "sections": "get_sections",
+    "submissions": "get_submissions",
+    "quiz_submissions": "get_submissions",
+    "students_submissions": "get_submissions"
+}
+
+
+def run_config(scenario: Dict, base_url: str, work_dir: str, max_concurrent: int) -> Dict:
+    return {
+        "execution": {"config": {"max_concurrent": max_concurrent}},
+        "ops": {
+            "term_id_generator": {"config": {"school_year_start_date": "2021-01-01"}},
+            "course_id_generator": {"config": {"batch_size": scenario["ops"]["batch_size"]}},
+            "get_submissions": {"config": {"bulk": scenario["ops"]["bulk"]}}
+        },
+        "resources": {
+            "file_manager": {"config": {
+                "directory": os.path.join(work_dir, "gcs"),
+                "gcs_bucket": "benchmark",
+                "gcs_prefix": "canvas"
+            }},
+            "warehouse": {"config": {"directory": os.path.join(work_dir, "warehouse")}},
+            "extract_io_manager": {"config": {"base_dir": os.path.join(work_dir, "extracts")}},
+            "canvas_api_client": {"config": {
+                "api_base_url": base_url,
+                "api_access_token": "benchmark",
+                "account_id": "1",
+                "shared_budget_dir": os.path.join(work_dir, "budget")
+            }}
+        }
+    }
+
+
+def stage_timings(instance, run_id: str) -> Dict:
+    """
+    Return the step count, summed step time and the
+    span from first start to last end of each stage.
+    """
+    starts, ends = dict(), dict()
+    for record in instance.all_logs(run_id):
+        event = record.dagster_event
+        if event is None or record.step_key is None:
+            continue
+        if event.event_type_value == "STEP_START":
+            starts[record.step_key] = record.timestamp
+        elif event.event_type_value in ("STEP_SUCCESS", "STEP_FAILURE"):
+            ends[record.step_key] = record.timestamp
+
+    stages = defaultdict(lambda: {"steps": 0, "step_seconds": 0.0})
+    for step_key, start in starts.items():
+        end = ends.get(step_key, start)
+        stage = stages[step_key.split("[")[0]]
+        stage["steps"] += 1
+        stage["step_seconds"] += end - start
+        stage["first_start"] = min(stage.get("first_start", start), start)
+        stage["last_end"] = max(stage.get("last_end", end), end)
+    for stage in stages.values():
+        stage["wall_seconds"] = stage.pop("last_end") - stage.pop("first_start")
+    return dict(stages)
+
+
+def uploaded_bytes(gcs_dir: str) -> Dict:
+    """
+    Return the bytes uploaded to each
+    endpoint folder, by upload stage.
+    """
+    folder_bytes = defaultdict(int)
+    prefix_dir = os.path.join(gcs_dir, "benchmark", "canvas")
+    for folder_name in os.listdir(prefix_dir) if os.path.isdir(prefix_dir) else list():
+        if folder_name.startswith("_"):
+            continue
+        for root, _, files in os.walk(os.path.join(prefix_dir, folder_name)):
+            folder_bytes[f"upload_{folder_name}"] += sum(
+                os.path.getsize(os.path.join(root, file_name)) for file_name in files)
+    return dict(folder_bytes)
+
+
+def peak_rss(path: str) -> Dict:
+    """
+    Return the largest peak RSS, in
+    megabytes, of any step of each stage.
+    """
+    stages = defaultdict(float)
+    if not os.path.exists(path):
+        return stages
+    with open(path) as f:
+        for line in f:
+            step = json.loads(line)
+            stage = step["step_key"].split("[")[0]
+            stages[stage] = max(stages[stage], step["peak_rss_kb"] / 1024)
+    return stages
+
+
+def run_scenario(name: str, max_concurrent: int) -> Dict:
+    """
+    Run the canvas job for a scenario and
+    return its report.
+    """
+    from canvas_bench_job import make_canvas_bench_job
+    from dagster import DagsterInstance, execute_pipeline, reconstructable
+
+    scenario = SCENARIOS[name]
+    canvas = SyntheticCanvas(District(**scenario["district"]), RateLimit(**scenario["rate_limit"]))
+    server = MockCanvasServer(canvas).start()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ["CANVAS_BENCH_PEAK_RSS_PATH"] = os.path.join(work_dir, "peak_rss.jsonl")
+        instance_dir = os.path.join(work_dir, "dagster")
+        os.makedirs(instance_dir)
+        instance = DagsterInstance.local_temp(instance_dir)
+        start = time.perf_counter()
+        result = execute_pipeline(
+            reconstructable(make_canvas_bench_job),
+            run_config=run_config(scenario, server.base_url, work_dir, max_concurrent),
+            instance=instance,
+            raise_on_error=False
+        )
+        wall_seconds = time.perf_counter() - start
+        stages = stage_timings(instance, result.run_id)
+        stage_bytes = uploaded_bytes(os.path.join(work_dir, "gcs"))
+        stage_rss = peak_rss(os.environ["CANVAS_BENCH_PEAK_RSS_PATH"])
+    server.shutdown()
+
+    api_stats = canvas.stats()
+    for endpoint, stage_name in ENDPOINT_STAGES.items():
+        if stage_name not in stages:
+            continue
+        stage = stages[stage_name]
+        stage["requests"] = stage.get("requests", 0) + api_stats["requests"].get(endpoint, 0)
+        stage["pages"] = stage.get("pages", 0) + api_stats["pages"].get(endpoint, 0)
+        stage["bytes"] = stage.get("bytes", 0) + api_stats["response_bytes"].get(endpoint, 0)
+    for stage_name, stage in stages.items():
+        stage["bytes"] = stage.get("bytes", 0) + stage_bytes.get(stage_name, 0)
+        stage["peak_rss_mb"] = stage_rss.get(stage_name)
+        if stage.get("requests") and stage["wall_seconds"] > 0:
+            stage["requests_per_second"] = stage["requests"] / stage["wall_seconds"]
+
+    return {
+        "scenario": name,
+        "success": result.success,
+        "wall_seconds": wall_seconds,
+        "status_counts": api_stats["status_counts"],
+        "stages": stages
+    }
+
+
+def print_report(report: Dict):
+    print(
+        f"\n{report['scenario']}: {'succeeded' if report['success'] else 'FAILED'} "
+        f"in {report['wall_seconds']:.1f}s, responses {report['status_counts']}"
+    )
+    print(
+        f"{'stage':28} {'steps':>6} {'wall s':>8} {'step s':>8} {'req/s':>8} "
+        f"{'requests':>9} {'pages':>7} {'MB':>8} {'rss MB':>7}"
+    )
+    for stage_name, stage in sorted(
+        report["stages"].items(), key=lambda item: item[1]["wall_seconds"], reverse=True):
+        print(
+            f"{stage_name:28} {stage['steps']:6d} {stage['wall_seconds']:8.2f} "
+            f"{stage['step_seconds']:8.2f} {stage.get('requests_per_second', 0):8.1f} "
+            f"{stage.get('requests', 0):9d} {stage.get('pages', 0):7d} "
+            f"{stage['bytes'] / 1024 ** 2:8.2f} {stage['peak_rss_mb'] or 0:7.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["small"])
+    parser.add_argument("--max-concurrent", type=int, default=8,
+        help="steps the multiprocess executor runs at once")
+    parser.add_argument("--output", help="write the reports to this JSON file")
+    args = parser.parse_args()
+
+    reports = list()
+    for name in args.scenario:
+        report = run_scenario(name, args.max_concurrent)
+        print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measure the import overhead every multiprocess step pays
+before it runs. Each module is imported in a fresh
+interpreter, as a step subprocess would, and the median
+wall time over several runs is reported after subtracting
+the cost of starting the interpreter itself.
+
+    python benchmarks/step_startup.py --runs 10
+
+Run it before and after a change to compare.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+
+# modules a step subprocess imports, from the repository
+# it loads down to the individual ops and resources
+MODULES = [
+    "repo",
+    "jobs.canvas",
+    "ops.canvas",
+    "resources.canvas_api_resource",
+    "resources.gcs_resource",
+    "resources.bq_resource",
+    "resources.extract_io_manager"
+]
+
+# placeholder values the job definition reads at import time
+JOB_ENV = {
+    "SCHOOL_YEAR_START_DATE": "2021-09-01",
+    "GCS_BUCKET_DEV": "benchmark",
+    "CANVAS_BASE_URL": "http://localhost",
+    "CANVAS_ACCESS_TOKEN": "benchmark",
+    "DBT_PROJECT_DIR": "project_dbt",
+    "DBT_PROFILES_DIR": "."
+}
+
+
+def time_import(module: str, env: dict) -> float:
+    """
+    Return the wall time of importing a
+    module in a fresh interpreter.
+    """
+    code = f"import {module}" if module else "pass"
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        cwd=PROJECT_DIR, env=env, check=True
+    )
+    return time.perf_counter() - start
+
+
+def heaviest_imports(module: str, env: dict, limit: int) -> list:
+    """
+    Return the slowest packages imported by a module,
+    from python -X importtime. Times are inclusive, so a
+    package imported by another counts toward both.
+    """
+    result = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, env=env, check=True, capture_output=True, text=True
+    )
+    project_packages = {name.split(".")[0] for name in MODULES}
+    packages = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if not cumulative.strip().isdigit() or "." in name or name in project_packages:
+            continue
+        packages.setdefault(name, int(cumulative))
+
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10,
+        help="number of heaviest packages listed for the repository import")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR, **JOB_ENV)
+    baseline = statistics.median(time_import("", env) for _ in range(args.runs))
+    print(f"{'interpreter':40} {baseline * 1000:8.0f} ms")
+    for module in MODULES:
+        elapsed = statistics.median(time_import(module, env) for _ in range(args.runs))
+        print(f"{module:40} {(elapsed - baseline) * 1000:8.0f} ms")
+
+    print(f"\nheaviest packages imported by {MODULES[0]}")
+    for package, micros in heaviest_imports(MODULES[0], env, args.top):
+        print(f"{package:40} {micros / 1000:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
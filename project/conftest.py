@@ -0,0 +1,2 @@
+# puts the project directory on sys.path so tests
+# import the resources and ops packages like the jobs do
@@ -1,15 +1,15 @@
 import os
 
 from dagster import fs_io_manager, graph, multiprocess_executor
-from dagster_dbt import dbt_cli_resource
-from dagster_gcp.gcs.io_manager import gcs_pickle_io_manager
-from dagster_gcp.gcs.resources import gcs_resource
-from ops.canvas import (course_id_generator,
-                        create_warehouse_tables, get_assignments, get_courses,
-                        get_enrollments, get_sections, get_submissions,
-                        get_terms, load_data, term_id_generator)
+from ops.canvas import (course_id_generator, create_warehouse_tables,
+                        finalize_load, get_assignments, get_courses,
+                        get_enrollments, get_high_water_marks, get_sections,
+                        get_submissions, get_terms, run_dbt,
+                        term_id_generator, upload_extract)
 from resources.bq_resource import bq_client
 from resources.canvas_api_resource import canvas_api_resource_client
+from resources.dbt_resource import dbt_cli_resource
+from resources.extract_io_manager import extract_io_manager
 from resources.gcs_resource import gcs_client
 
 
@@ -25,25 +25,52 @@ def canvas():
 
     warehouse_tables_result = create_warehouse_tables()
 
+    # every extract step uploads its own files as soon as
+    # it finishes, and each endpoint is finalized once all
+    # of its steps have uploaded
     terms = get_terms()
-    terms_gcs_path = load_data.alias("load_terms")(terms)
+    terms_gcs_path = finalize_load.alias("load_terms")(
+        [upload_extract.alias("upload_terms")(terms)],
+        start_after=warehouse_tables_result)
 
-    courses = term_id_generator(terms).map(get_courses).collect()
-    courses_gcs_path = load_data.alias("load_courses")(courses)
+    courses = term_id_generator(terms).map(get_courses)
+    courses_gcs_path = finalize_load.alias("load_courses")(
+        courses.map(upload_extract.alias("upload_courses")).collect(),
+        start_after=warehouse_tables_result)
 
-    course_ids = course_id_generator(courses)
+    course_ids = course_id_generator(courses.collect())
+    high_water_marks = get_high_water_marks()
 
-    enrollments = course_ids.map(get_enrollments).collect()
-    enrollments_gcs_path = load_data.alias("load_enrollments")(enrollments)
+    enrollments = course_ids.map(get_enrollments)
+    enrollments_gcs_path = finalize_load.alias("load_enrollments")(
+        enrollments.map(upload_extract.alias("upload_enrollments")).collect(),
+        start_after=warehouse_tables_result)
 
-    sections = course_ids.map(get_sections).collect()
-    sections_gcs_path = load_data.alias("load_sections")(sections)
+    sections = course_ids.map(get_sections)
+    sections_gcs_path = finalize_load.alias("load_sections")(
+        sections.map(upload_extract.alias("upload_sections")).collect(),
+        start_after=warehouse_tables_result)
 
-    assignments = course_ids.map(get_assignments)
-    assignments_gcs_path = load_data.alias("load_assignments")(assignments.collect())
+    assignments = course_ids.map(
+        lambda course_id: get_assignments(course_id, high_water_marks))
+    assignments_gcs_path = finalize_load.alias("load_assignments")(
+        assignments.map(upload_extract.alias("upload_assignments")).collect(),
+        start_after=warehouse_tables_result)
 
-    submissions = assignments.map(get_submissions).collect()
-    submissions_gcs_path = load_data.alias("load_submissions")(submissions)
+    submissions = assignments.map(
+        lambda assignment: get_submissions(assignment, high_water_marks))
+    submissions_gcs_path = finalize_load.alias("load_submissions")(
+        submissions.map(upload_extract.alias("upload_submissions")).collect(),
+        start_after=warehouse_tables_result)
+
+    run_dbt(high_water_marks, start_after=[
+        terms_gcs_path,
+        courses_gcs_path,
+        enrollments_gcs_path,
+        sections_gcs_path,
+        assignments_gcs_path,
+        submissions_gcs_path
+    ])
 
 
 canvas_dev_job = canvas.to_job(
@@ -51,16 +78,22 @@ canvas_dev_job = canvas.to_job(
         "max_concurrent": 8
     }),
     resource_defs={
-        "gcs": gcs_resource,
         "file_manager": gcs_client.configured({
             "gcs_bucket": os.getenv("GCS_BUCKET_DEV"),
             "gcs_prefix": "canvas"
         }),
         "io_manager": fs_io_manager,
+        "extract_io_manager": extract_io_manager.configured({
+            "projection": "dbt",
+            "dbt_project_dir": os.getenv('DBT_PROJECT_DIR')
+        }),
         "canvas_api_client": canvas_api_resource_client.configured({
             "api_base_url": os.getenv('CANVAS_BASE_URL'),
             "api_access_token": os.getenv('CANVAS_ACCESS_TOKEN'),
-            "account_id": "1"
+            "account_id": "1",
+            "response_cache_dir": os.getenv('CANVAS_RESPONSE_CACHE_DIR') or None,
+            "shared_budget_dir": os.getenv('CANVAS_SHARED_BUDGET_DIR') or None,
+            "provisioning_report_dir": os.getenv('CANVAS_PROVISIONING_REPORT_DIR') or None
         }),
         "warehouse": bq_client.configured({
             "dataset": "dev_staging",
@@ -72,8 +105,14 @@ canvas_dev_job = canvas.to_job(
         })
     },
     config={"ops": {
+        "course_id_generator": {
+            "config": {"batch_size": 50}
+        },
         "term_id_generator": {
             "config": {"school_year_start_date": os.getenv('SCHOOL_YEAR_START_DATE')}
+        },
+        "get_submissions": {
+            "config": {"bulk": True}
         }
     }}
 )
@@ -1,39 +1,183 @@
-import json
-from typing import Dict, List
+import heapq
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List
 
-import pandas as pd
-from dagster import (DynamicOut, DynamicOutput, ExpectationResult, Out, Output,
+from dagster import (AssetMaterialization, DynamicOut, DynamicOutput,
+                     ExpectationResult, Field, In, Nothing, Out, Output,
                      RetryPolicy, op)
-from google.cloud import bigquery
+from resources.extract_io_manager import ExtractPayload
+
+# data lake folders and the external
+# tables that read them
+WAREHOUSE_TABLES = [
+    {"folder_name": "assignments", "table_name": "canvas_assignments"},
+    {"folder_name": "courses", "table_name": "canvas_courses"},
+    {"folder_name": "enrollments", "table_name": "canvas_enrollments"},
+    {"folder_name": "sections", "table_name": "canvas_sections"},
+    {"folder_name": "submissions", "table_name": "canvas_submissions"},
+    {"folder_name": "terms", "table_name": "canvas_terms"}
+]
+
+# schema of the newline delimited JSON landing files,
+# in the API representation BigQuery accepts for schemas
+LANDING_JSON_SCHEMA = [
+    {"name": "id", "type": "STRING", "mode": "NULLABLE"},
+    {"name": "course_id", "type": "INTEGER", "mode": "NULLABLE"},
+    {"name": "data", "type": "STRING", "mode": "NULLABLE"}
+]
+
+# endpoints that support incremental extraction
+# using per course high-water marks
+INCREMENTAL_ENDPOINTS = ["assignments", "submissions"]
+
+# key of the extraction time stamped on submissions,
+# which incremental staging models filter on
+EXTRACTED_AT_KEY = "_extracted_at"
+
+# courses of a batch fetched together by the async client
+# while a streamed extract is written, bounding the records
+# held in memory to those of this many courses
+COURSES_PER_FETCH = 10
 
 
 @op(
-    description="Yields dynamic outputs containing each course id",
-    out=DynamicOut(int)
+    description="Yields dynamic outputs containing batches of course ids",
+    config_schema={
+        "batch_size": Field(int, default_value=1,
+            description=(
+                "Number of course ids in each dynamic output. "
+                "A batch size of 1 fans out one step per course."
+            )
+        ),
+        "largest_first": Field(bool, default_value=True,
+            description=(
+                "Balance batches by each course's estimated cost and "
+                "output the most expensive first, so the largest courses "
+                "do not start last and hold up the run."
+            )
+        )
+    },
+    out=DynamicOut(List[int])
 )
-def course_id_generator(context, courses: List[Dict]) -> List:
+def course_id_generator(context, courses: List[ExtractPayload]) -> List:
     """
-    Dynamically output each course id to allow
+    Dynamically output batches of course ids to allow
     for downstream course related data to be
-    extracted in parallel.
+    extracted in parallel, with each batch
+    extracted inside a single step.
+
+    Courses are costed by their total students. When
+    largest_first is set, courses are spread over the batches
+    so each holds a similar cost, and batches are output from
+    the most to the least expensive, which the executor
+    starts in that order.
 
     Args:
-        courses List[Dict]:
+        courses List[ExtractPayload]:
             courses is a list of the courses fetched for
-            each Canvas term. Each list item is a dict
-            containing a value key that holds the actual
-            records retrieved.
+            each Canvas term. Each list item reads like a
+            dict containing a value key that holds the
+            actual records retrieved.
 
             ie. [{"folder_name": "courses", "value": List of records},
                  {"folder_name": "courses", "value": List of records}]
     """
-    for course_list in courses:
-        for course in course_list["value"]:
-            id = course["id"]
-            yield DynamicOutput(
-                value=id,
-                mapping_key=str(id)
-            )
+    batch_size = context.op_config["batch_size"]
+    course_costs = [
+        (course["id"], _course_cost(course))
+        for course_list in courses
+        for course in course_list["value"]
+    ]
+    if context.op_config["largest_first"]:
+        batches = _balanced_batches(course_costs, batch_size)
+    else:
+        course_ids = [course_id for course_id, _ in course_costs]
+        batches = [
+            course_ids[i:i+batch_size]
+            for i in range(0, len(course_ids), batch_size)
+        ]
+
+    for i, batch in enumerate(batches):
+        yield DynamicOutput(
+            value=batch,
+            mapping_key=str(batch[0]) if batch_size == 1 else f"batch_{i}"
+        )
+
+
+def _course_cost(course: Dict) -> int:
+    """
+    Estimate the cost of extracting a course. Enrollment
+    and submission pages grow with its students, and every
+    course costs at least its first page of each endpoint.
+    """
+    return 1 + (course.get("total_students") or 0)
+
+
+def _balanced_batches(course_costs: List, batch_size: int) -> List[List[int]]:
+    """
+    Spread (course id, cost) pairs over the fewest batches
+    of at most batch_size courses, placing the most expensive
+    course first into the cheapest batch with room, and
+    return the batches from the most to the least expensive.
+    """
+    batch_count = -(-len(course_costs) // batch_size)
+    # heap of (total cost, batch index) of the batches with room
+    open_batches = [(0, i) for i in range(batch_count)]
+    batches = [list() for _ in range(batch_count)]
+    batch_costs = [0] * batch_count
+    for course_id, cost in sorted(course_costs, key=lambda item: item[1], reverse=True):
+        total, i = heapq.heappop(open_batches)
+        batches[i].append(course_id)
+        batch_costs[i] = total + cost
+        if len(batches[i]) < batch_size:
+            heapq.heappush(open_batches, (batch_costs[i], i))
+
+    order = sorted(range(batch_count), key=lambda i: batch_costs[i], reverse=True)
+    return [batches[i] for i in order]
+
+
+def _iter_course_endpoint(context, endpoint: str, course_ids: List[int]) -> Iterator:
+    """
+    Yield (course id, records) of a course level endpoint
+    for each course in a batch. Batches of courses are
+    fetched COURSES_PER_FETCH at a time with the async
+    client, a single course's pages are streamed.
+    """
+    canvas_api_client = context.resources.canvas_api_client
+    if len(course_ids) == 1:
+        yield course_ids[0], getattr(canvas_api_client, f"get_{endpoint}")(
+            course_ids[0], stream=True)
+        return
+
+    for i in range(0, len(course_ids), COURSES_PER_FETCH):
+        yield from canvas_api_client.get_course_batch(
+            course_ids[i:i+COURSES_PER_FETCH], [endpoint])[endpoint].items()
+
+
+def _iter_course_records(context, endpoint: str, course_ids: List[int]) -> Iterator[Dict]:
+    """
+    Yield every record of a course level
+    endpoint for a batch of courses.
+    """
+    for _, course_records in _iter_course_endpoint(context, endpoint, course_ids):
+        yield from course_records
+
+
+def _api_metrics_materialization(context, folder_name: str) -> AssetMaterialization:
+    """
+    Return the hot path metrics of a streamed extract as
+    metadata of its data lake folder. Its requests are made
+    while the IO manager writes the output, after the
+    output's metadata is set.
+    """
+    return AssetMaterialization(
+        asset_key=["canvas", folder_name],
+        description="Canvas API metrics of the extract",
+        partition=context.get_mapping_key(),
+        metadata={
+            "api_metrics": context.resources.canvas_api_client.metrics.drain()
+        }
+    )
 
 
 @op(
@@ -44,27 +188,36 @@ def course_id_generator(context, courses: List[Dict]) -> List:
 def create_warehouse_tables(context):
     """
     Create a folder for each api endpoint
-    to store raw JSON.
+    to store raw JSON. Native tables are created
+    by their first load instead.
     """
-    bucket_name=context.resources.file_manager.gcs_bucket
-    gcs_prefix=context.resources.file_manager.gcs_prefix
-    schema = [
-        bigquery.SchemaField("id", "STRING", "NULLABLE"),
-        bigquery.SchemaField("data", "STRING", "NULLABLE")
-    ]
-    tables = [
-        {"folder_name": "assignments", "table_name": "canvas_assignments"},
-        {"folder_name": "courses", "table_name": "canvas_courses"},
-        {"folder_name": "enrollments", "table_name": "canvas_enrollments"},
-        {"folder_name": "sections", "table_name": "canvas_sections"},
-        {"folder_name": "submissions", "table_name": "canvas_submissions"},
-        {"folder_name": "terms", "table_name": "canvas_terms"}
-    ]
-    for table in tables:
-        external_config = bigquery.ExternalConfig("NEWLINE_DELIMITED_JSON")
-        external_config.source_uris = [f"gs://{bucket_name}/{gcs_prefix}/{table['folder_name']}/*.json"]
+    from google.cloud import bigquery
+
+    if context.resources.warehouse.load_mode == "native":
+        return "Warehouse tables are created by load jobs"
+
+    file_manager = context.resources.file_manager
+    for table in WAREHOUSE_TABLES:
+        if file_manager.landing_format == "parquet":
+            # typed columns are read from the parquet files and
+            # run and partition ids from their hive paths
+            external_config = bigquery.ExternalConfig("PARQUET")
+            hive_partitioning = bigquery.external_config.HivePartitioningOptions()
+            hive_partitioning.mode = "AUTO"
+            hive_partitioning.source_uri_prefix = file_manager.folder_prefix_uri(table["folder_name"])
+            external_config.hive_partitioning = hive_partitioning
+            table_schema = None
+        else:
+            external_config = bigquery.ExternalConfig("NEWLINE_DELIMITED_JSON")
+            external_config.ignore_unknown_values = True
+            if file_manager.compress:
+                external_config.compression = "GZIP"
+            table_schema = LANDING_JSON_SCHEMA
+        external_config.source_uris = [
+            file_manager.folder_uri(table["folder_name"])
+        ]
         result = context.resources.warehouse.create_table(
-            schema=schema,
+            schema=table_schema,
             external_config=external_config,
             table_name=table["table_name"]
         )
@@ -73,32 +226,145 @@ def create_warehouse_tables(context):
 
 
 @op(
-    description="Retrieves all assignments for a specific course",
+    description="Switch the warehouse to the extract uploaded to the data lake",
+    ins={"start_after": In(Nothing)},
+    required_resource_keys={"file_manager", "warehouse"},
+    retry_policy=RetryPolicy(max_retries=3, delay=10),
+    tags={"kind": "load"},
+)
+def finalize_load(context, uploads: List[Dict]) -> List[str]:
+    """
+    Once every step of an endpoint has uploaded its
+    extract under the root run's prefix, switch the external
+    table to read it. Return list of GCS file paths.
+
+    Args:
+        uploads List[Dict]:
+            outputs of upload_extract for every
+            step that extracted the endpoint.
+
+    A full extract replaces the files the table reads
+    and the previous runs' files are deleted in the
+    background. Incremental extracts are added to the
+    files the table already reads and their
+    high-water marks are persisted.
+
+    When the warehouse loads native tables the run's
+    files are loaded into the table instead of being
+    read through an external table.
+
+    Re-executions of a run upload under the root run's
+    prefix too, so the files of steps that succeeded in
+    the original run are kept. When nothing was uploaded,
+    the table keeps reading the files it already did.
+    Incremental runs add their prefix to the table's source
+    URIs, which the next full extract replaces with its own.
+    """
+    file_manager = context.resources.file_manager
+    folder_name = uploads[0]["folder_name"]
+    table_name = next(
+        table["table_name"] for table in WAREHOUSE_TABLES
+        if table["folder_name"] == folder_name
+    )
+    incremental = uploads[0]["incremental"]
+    gcs_paths = [gcs_path for upload in uploads for gcs_path in upload["gcs_paths"]]
+    run_id = context.pipeline_run.root_run_id or context.run_id
+
+    run_uri = file_manager.run_uri(folder_name, run_id)
+    if not gcs_paths:
+        context.log.info(f"No {folder_name} files were uploaded, keeping {table_name}'s files")
+        if not incremental:
+            context.log.warning(f"The full {folder_name} extract was empty")
+    elif context.resources.warehouse.load_mode == "native":
+        _load_native_table(context, folder_name, table_name, run_uri, incremental)
+    elif incremental:
+        source_uris = context.resources.warehouse.get_source_uris(table_name)
+        if file_manager.folder_uri(folder_name) not in source_uris and run_uri not in source_uris:
+            source_uris.append(run_uri)
+        context.resources.warehouse.update_source_uris(table_name, source_uris)
+    else:
+        context.resources.warehouse.update_source_uris(table_name, [run_uri])
+
+    if incremental:
+        state = file_manager.read_state(folder_name)
+        for upload in uploads:
+            for course in upload["courses"]:
+                state[course["course_id"]] = course["high_water_mark"]
+        file_manager.write_state(folder_name, state)
+    elif gcs_paths:
+        file_manager.delete_stale_runs(folder_name, run_id)
+    file_manager.delete_checkpoints(folder_name, run_id)
+
+    yield Output(
+        value=gcs_paths,
+        metadata={
+            "file_count": len(gcs_paths),
+            "record_count": sum(upload["record_count"] for upload in uploads)
+        }
+    )
+
+
+@op(
+    description="Retrieves all assignments for a batch of courses",
     required_resource_keys={"canvas_api_client"},
     retry_policy=RetryPolicy(max_retries=3, delay=10),
+    out=Out(io_manager_key="extract_io_manager"),
     tags={"kind": "extract"}
 )
-def get_assignments(context, course_id: int) -> List:
+def get_assignments(context, course_ids: List[int], high_water_marks: Dict) -> List:
     """
-    Retrieve all assignments for a specific course
+    Retrieve all assignments for a batch of courses.
+    When extracting incrementally only assignments
+    updated since each course's high-water mark are output.
+
+    Records are streamed to the extract_io_manager, which
+    records their count, and courses is filled in as
+    they are written.
     """
-    records = context.resources.canvas_api_client.get_assignments(course_id)
+    extracted_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    courses = list()
     yield Output(
         value={
-            "course_id": str(course_id),
+            "courses": courses,
             "folder_name": "assignments",
-            "value": records
-        },
-        metadata={
-            "record_count": len(records)
+            "value": _iter_assignments(
+                context, course_ids, high_water_marks, extracted_at, courses),
+            "incremental": high_water_marks["incremental"]
         }
     )
+    yield _api_metrics_materialization(context, "assignments")
+
+
+def _iter_assignments(context, course_ids: List[int], high_water_marks: Dict,
+    extracted_at: str, courses: List[Dict]) -> Iterator[Dict]:
+    """
+    Yield the assignments of a batch of courses, appending
+    each course's assignment count and new high-water mark
+    to courses once its assignments have been yielded.
+    """
+    incremental = high_water_marks["incremental"]
+    for course_id, course_records in _iter_course_endpoint(
+        context, "assignments", course_ids):
+        since = high_water_marks["assignments"].get(str(course_id)) if incremental else None
+        assignment_count = 0
+        for record in course_records:
+            assignment_count += 1
+            # the assignments endpoint can not filter by updated_at
+            if since and (record.get("updated_at") or "") <= since:
+                continue
+            yield record
+        courses.append({
+            "course_id": str(course_id),
+            "assignment_count": assignment_count,
+            "high_water_mark": extracted_at
+        })
 
 
 @op(
     description="Retrieves all courses configured for specified account",
     required_resource_keys={"canvas_api_client"},
     retry_policy=RetryPolicy(max_retries=3, delay=10),
+    out=Out(io_manager_key="extract_io_manager"),
     tags={"kind": "extract"}
 )
 def get_courses(context, term_id: int) -> List:
@@ -112,113 +378,240 @@ def get_courses(context, term_id: int) -> List:
             "value": records
         },
         metadata={
-            "record_count": len(records)
+            "record_count": len(records),
+            "api_metrics": context.resources.canvas_api_client.metrics.drain()
         }
     )
 
 
 @op(
-    description="Retrieves all enrollments for a specific course",
+    description="Retrieves all enrollments for a batch of courses",
     required_resource_keys={"canvas_api_client"},
     retry_policy=RetryPolicy(max_retries=3, delay=10),
+    out=Out(io_manager_key="extract_io_manager"),
     tags={"kind": "extract"}
 )
-def get_enrollments(context, course_id: int) -> List:
+def get_enrollments(context, course_ids: List[int]) -> List:
     """
-    Retrieve all enrollments for a specific course
+    Retrieve all enrollments for a batch of courses,
+    streamed to the extract_io_manager
     """
-    records = context.resources.canvas_api_client.get_enrollments(course_id)
     yield Output(
         value={
             "folder_name": "enrollments",
-            "value": records
-        },
-        metadata={
-            "record_count": len(records)
+            "value": _iter_course_records(context, "enrollments", course_ids)
         }
     )
+    yield _api_metrics_materialization(context, "enrollments")
+
+
+@op(
+    description="Retrieves high-water marks of incrementally extracted endpoints",
+    config_schema={
+        "incremental": Field(bool, default_value=False,
+            description=(
+                "Only extract assignments and submissions changed "
+                "since each course's last successful load."
+            )
+        )
+    },
+    required_resource_keys={"file_manager"},
+    retry_policy=RetryPolicy(max_retries=3, delay=10),
+)
+def get_high_water_marks(context) -> Dict:
+    """
+    Return the high-water mark of each course for
+    every incrementally extracted endpoint. Marks are
+    empty when extracting everything.
+
+    ie. {"incremental": True,
+         "assignments": {"course_id": "2021-09-01T00:00:00Z"},
+         "submissions": {"course_id": "2021-09-01T00:00:00Z"}}
+    """
+    incremental = context.op_config["incremental"]
+    high_water_marks = {"incremental": incremental}
+    for folder_name in INCREMENTAL_ENDPOINTS:
+        if incremental:
+            high_water_marks[folder_name] = context.resources.file_manager.read_state(folder_name)
+        else:
+            high_water_marks[folder_name] = dict()
+
+    return high_water_marks
 
 
 @op(
-    description="Retrieves all sections for a specific course",
+    description="Retrieves all sections for a batch of courses",
     required_resource_keys={"canvas_api_client"},
     retry_policy=RetryPolicy(max_retries=3, delay=10),
+    out=Out(io_manager_key="extract_io_manager"),
     tags={"kind": "extract"}
 )
-def get_sections(context, course_id: int) -> List:
+def get_sections(context, course_ids: List[int]) -> List:
     """
-    Retrieve all sections for a specific course
+    Retrieve all sections for a batch of courses,
+    streamed to the extract_io_manager
     """
-    records = context.resources.canvas_api_client.get_sections(course_id)
     yield Output(
         value={
             "folder_name": "sections",
-            "value": records
-        },
-        metadata={
-            "record_count": len(records)
+            "value": _iter_course_records(context, "sections", course_ids)
         }
     )
+    yield _api_metrics_materialization(context, "sections")
 
 
 @op(
     description="Retrieves all assignment and quiz submissions",
-    required_resource_keys={"canvas_api_client"},
+    config_schema={
+        "bulk": Field(bool, default_value=False,
+            description=(
+                "Pull every submission in the course from the "
+                "students/submissions endpoint instead of "
+                "one assignment at a time."
+            )
+        ),
+        "checkpoint_pages": Field(bool, default_value=False,
+            description=(
+                "Record every fetched page in GCS so retries and "
+                "re-executions resume where they failed, at the "
+                "cost of one object write per page. Meant for "
+                "backfills and other long runs."
+            )
+        )
+    },
+    required_resource_keys={"canvas_api_client", "file_manager"},
     retry_policy=RetryPolicy(max_retries=3, delay=10),
+    out=Out(io_manager_key="extract_io_manager"),
     tags={"kind": "extract"}
 )
-def get_submissions(context, assignments: Dict) -> List:
+def get_submissions(context, assignments: ExtractPayload, high_water_marks: Dict) -> List:
     """
-    Loop through all assignments in a course,
+    Loop through all assignments in a batch of courses,
     fetching their submissions, and return
-    a list containing all submissions for that course.
+    a list containing all submissions for those courses.
 
     Args:
-        assignments Dict:
-            assignments is a list of the assignments fetched for
-            each Canvas course. Each list item is a dict
-            containing a value key that holds the actual
-            records retrieved.
-
-            ie. [{
-                "course_id: id of course assignments pertain to,
+        assignments ExtractPayload:
+            assignments fetched for a batch of Canvas courses.
+            The value key holds the actual records retrieved
+            and the courses key describes each course.
+
+            ie. {
+                "courses": [{
+                    "course_id": id of course,
+                    "assignment_count": assignments in course,
+                    "high_water_mark": time assignments were extracted}],
                 "folder_name": "assignments",
-                "value": List of records}]
+                "value": List of records}
+        high_water_marks Dict:
+            output of get_high_water_marks
+
+    In bulk mode quiz submissions are returned as the
+    submissions of the quiz's assignment, in the same
+    shape as every other assignment submission. Incremental
+    extraction always uses bulk mode, filtered to submissions
+    submitted or graded since the course's high-water mark.
+
+    When checkpoint_pages is set, every page fetched is
+    checkpointed so a retry, or a re-execution of the run,
+    only requests the pages that were not fetched before
+    the failure.
+
+    Records are streamed to the extract_io_manager, which
+    records their count, and courses is filled in as
+    they are written. Each record is stamped with the time
+    it was extracted for the incremental staging model.
     """
-    records = list()
-    course_id = assignments["course_id"]
-    for assignment in assignments["value"]:
+    extracted_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    checkpoints = None
+    if context.op_config["checkpoint_pages"]:
+        checkpoints = context.resources.file_manager.page_checkpoints(
+            "submissions",
+            context.pipeline_run.root_run_id or context.run_id,
+            context.get_mapping_key() or "all"
+        )
+    courses = list()
+    yield Output(
+        value={
+            "courses": courses,
+            "folder_name": "submissions",
+            "value": _iter_submissions(
+                context, assignments, high_water_marks, extracted_at, courses, checkpoints),
+            "incremental": high_water_marks["incremental"]
+        },
+        metadata={
+            "resumed_pages": len(checkpoints.completed) if checkpoints is not None else 0
+        }
+    )
+    yield _api_metrics_materialization(context, "submissions")
+
+
+def _iter_submissions(context, assignments: ExtractPayload, high_water_marks: Dict,
+    extracted_at: str, courses: List[Dict], checkpoints) -> Iterator[Dict]:
+    """
+    Yield the submissions of each course in a batch,
+    serving and recording pages through checkpoints, and
+    append each course's new high-water mark to courses.
+    """
+    canvas_api_client = context.resources.canvas_api_client
+    incremental = high_water_marks["incremental"]
+    bulk = context.op_config["bulk"] or incremental
+    # assignment records are only needed, and decoded
+    # once, when fetching one assignment at a time
+    assignment_records = list() if bulk else assignments["value"]
+    with canvas_api_client.resume_from(checkpoints):
+        for course in assignments["courses"]:
+            course_id = course["course_id"]
+            for record in _iter_course_submissions(
+                canvas_api_client, course, assignment_records, bulk,
+                high_water_marks["submissions"].get(course_id) if incremental else None):
+                # submissions do not include their course so
+                # it is added to allow partitioning by course
+                record.setdefault("course_id", int(course_id))
+                record[EXTRACTED_AT_KEY] = extracted_at
+                yield record
+            courses.append({"course_id": course_id, "high_water_mark": extracted_at})
+
+
+def _iter_course_submissions(canvas_api_client, course: Dict,
+    assignment_records: List[Dict], bulk: bool, since: str = None) -> Iterator[Dict]:
+    """
+    Yield the submissions of a single course, in bulk
+    or one assignment at a time.
+    """
+    course_id = course["course_id"]
+    if bulk:
+        if course["assignment_count"] > 0:
+            yield from canvas_api_client.get_submissions(
+                course_id=course_id, bulk=True, since=since, stream=True)
+        return
+
+    for assignment in assignment_records:
+        if str(assignment["course_id"]) != course_id:
+            continue
         if assignment["is_quiz_assignment"] is True:
-            quizzes = context.resources.canvas_api_client.get_submissions(
+            quizzes = canvas_api_client.get_submissions(
                 course_id=course_id,
                 assignment_id=str(assignment["quiz_id"]),
                 assignment_type="quiz",
                 pagination=False
             )
-            records = records + quizzes["quiz_submissions"]
+            yield from quizzes.get("quiz_submissions", list())
         else:
-            records = records + context.resources.canvas_api_client.get_submissions(
+            yield from canvas_api_client.get_submissions(
                 course_id=course_id,
                 assignment_id=str(assignment["id"]),
                 assignment_type="assignment",
-                pagination=True
+                pagination=True,
+                stream=True
             )
 
-    yield Output(
-        value={
-            "folder_name": "submissions",
-            "value": records
-        },
-        metadata={
-            "record_count": len(records)
-        }
-    )
-
 
 @op(
     description="Retrieves all terms configured for specified account",
     required_resource_keys={"canvas_api_client"},
     retry_policy=RetryPolicy(max_retries=3, delay=10),
+    out=Out(io_manager_key="extract_io_manager"),
     tags={"kind": "extract"}
 )
 def get_terms(context) -> List:
@@ -230,31 +623,71 @@ def get_terms(context) -> List:
             "value": records
         }],
         metadata={
-            "record_count": len(records)
+            "record_count": len(records),
+            "api_metrics": context.resources.canvas_api_client.metrics.drain()
         }
     )
 
 
+def _load_native_table(context, folder_name: str, table_name: str,
+    run_uri: str, incremental: bool):
+    """
+    Load a run's files into a native table clustered by
+    course, replacing the table for full extracts and
+    merging on the record id for incremental extracts.
+    """
+    file_manager = context.resources.file_manager
+    if file_manager.landing_format == "parquet":
+        source_format = "PARQUET"
+        schema = None
+        hive_partitioning_prefix = file_manager.folder_prefix_uri(folder_name)
+        merge_key = "{alias}.id"
+        course_field = "id" if folder_name == "courses" else "course_id"
+    else:
+        source_format = "NEWLINE_DELIMITED_JSON"
+        schema = LANDING_JSON_SCHEMA
+        hive_partitioning_prefix = None
+        merge_key = "JSON_EXTRACT_SCALAR({alias}.data, '$.id')"
+        course_field = "course_id"
+
+    context.resources.warehouse.load_table(
+        table_name=table_name,
+        source_uris=[run_uri],
+        source_format=source_format,
+        schema=schema,
+        clustering_fields=None if folder_name == "terms" else [course_field],
+        hive_partitioning_prefix=hive_partitioning_prefix,
+        merge_key=merge_key if incremental else None
+    )
+
+
 @op(
-    description="Persist extract to data lake",
-    required_resource_keys={"file_manager"},
-    tags={"kind": "load"},
+    description="Run dbt models over the loaded data",
+    ins={"start_after": In(Nothing)},
+    config_schema={
+        "models": Field([str], default_value=["staging"],
+            description="dbt models to run.")
+    },
+    required_resource_keys={"dbt"},
+    tags={"kind": "transform"},
 )
-def load_data(context, extract: List) -> List[str]:
-    """
-    Upload extract to Google Cloud Storage.
-    Return list of GCS file paths.
-    """
-    records = list()
-    for set_of_records in extract:
-        for record in set_of_records["value"]:
-            records.append({
-                "id": None,
-                "data": json.dumps(record)
-            })
-    return context.resources.file_manager.upload_json(
-        folder_name=extract[0]["folder_name"],
-        records=records
+def run_dbt(context, high_water_marks: Dict) -> Dict:
+    """
+    Run the dbt models once every endpoint has
+    been loaded. Incremental models only process
+    rows landed since their last run, and are rebuilt
+    after full extracts so records deleted from Canvas
+    are dropped.
+    """
+    full_refresh = not high_water_marks["incremental"]
+    result = context.resources.dbt.run(
+        models=context.op_config["models"], full_refresh=full_refresh)
+    yield Output(
+        value=result.result,
+        metadata={
+            "return_code": result.return_code,
+            "full_refresh": full_refresh
+        }
     )
 
 
@@ -263,20 +696,101 @@ def load_data(context, extract: List) -> List[str]:
     config_schema={"school_year_start_date": str},
     out=DynamicOut(int)
 )
-def term_id_generator(context, terms: List) -> List:
+def term_id_generator(context, terms: List[ExtractPayload]) -> List:
     """
-    Load terms extract into a dataframe,
-    filter dataframe to only terms on or after
-    school year start date, dynamically
+    Filter terms extract to only terms starting on
+    or after school year start date, dynamically
     output the term ids
     """
-    school_year_start_date = context.op_config["school_year_start_date"]
-    df = pd.DataFrame(terms[0]["value"])
-    df["start_at"] = pd.to_datetime(df["start_at"])
-    current_terms_df = df[(df["start_at"] >= school_year_start_date)]
+    school_year_start_date = _parse_timestamp(context.op_config["school_year_start_date"])
+    for term in terms[0]["value"]:
+        if term.get("start_at") and _parse_timestamp(term["start_at"]) >= school_year_start_date:
+            yield DynamicOutput(
+                value=term["id"],
+                mapping_key=str(term["id"])
+            )
 
-    for id in current_terms_df['id']:
-        yield DynamicOutput(
-            value=id,
-            mapping_key=str(id)
+
+def _parse_timestamp(value: str) -> datetime:
+    """
+    Parse an ISO 8601 date or timestamp, treating
+    values without a UTC offset as UTC.
+    """
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+@op(
+    description="Upload an extract to the data lake",
+    required_resource_keys={"file_manager"},
+    retry_policy=RetryPolicy(max_retries=3, delay=10),
+    tags={"kind": "load"},
+)
+def upload_extract(context, extract) -> Dict:
+    """
+    Upload the output of a single extract step to
+    Google Cloud Storage under the root run's prefix, as
+    soon as that step finishes, and return what
+    finalize_load needs to switch the warehouse to it.
+
+    Files are named after the step's mapping key, and
+    a retried or re-executed step first deletes the files
+    an earlier attempt uploaded so none are read twice.
+
+    Args:
+        extract ExtractPayload or List[ExtractPayload]:
+            output of an extract op, read from the
+            extract_io_manager. JSON landing files are
+            streamed from its files without decoding
+            the records.
+
+    ie. {"folder_name": "sections",
+         "gcs_paths": List of GCS file paths,
+         "record_count": records uploaded,
+         "incremental": False,
+         "courses": List of course high-water marks}
+    """
+    file_manager = context.resources.file_manager
+    extracts = extract if isinstance(extract, list) else [extract]
+    folder_name = extracts[0]["folder_name"]
+    run_id = context.pipeline_run.root_run_id or context.run_id
+    scope = context.get_mapping_key() or "all"
+    if context.retry_number > 0 or run_id != context.run_id:
+        file_manager.delete_upload(folder_name, run_id, scope)
+
+    if file_manager.landing_format == "json":
+        # extracts are already encoded as landing lines
+        gcs_paths = file_manager.upload_lines(
+            folder_name=folder_name,
+            lines=(line for payload in extracts for line in payload.lines()),
+            run_id=run_id,
+            scope=scope
+        )
+    else:
+        gcs_paths = file_manager.upload_records(
+            folder_name=folder_name,
+            records=(record for payload in extracts for record in payload.records()),
+            run_id=run_id,
+            scope=scope
         )
+
+    record_count = sum(payload["record_count"] for payload in extracts)
+    yield Output(
+        value={
+            "folder_name": folder_name,
+            "gcs_paths": gcs_paths,
+            "record_count": record_count,
+            "incremental": extracts[0].get("incremental", False),
+            "courses": [
+                course for payload in extracts
+                for course in payload.get("courses", list())
+            ]
+        },
+        metadata={
+            "record_count": record_count,
+            "file_count": len(gcs_paths),
+            "upload_metrics": file_manager.metrics.drain()["endpoints"]
+        }
+    )
@@ -1,18 +1,38 @@
-from typing import List, Dict
+from __future__ import annotations
 
-from dagster import get_dagster_logger
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterator, List
+
+from dagster import Enum, EnumValue, Field, get_dagster_logger
 from dagster import resource
-from dagster.config import source
-from google.cloud import bigquery
-import pandas as pd
+
+# google cloud, pandas and pyarrow are imported where they
+# are used so steps that never touch the warehouse do not
+# pay for importing them
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+    from google.cloud import bigquery, bigquery_storage
+
+# record batches buffered between the stream
+# readers and the consumer of a table read
+READ_QUEUE_SIZE = 8
+
+_STREAM_DONE = object()
 
 
 class BigQueryClient:
     """Class for interacting with BigQuery"""
 
-    def __init__(self, dataset):
+    def __init__(self, dataset, load_mode="external"):
+        from google.cloud import bigquery, bigquery_storage
+
         self.dataset = dataset
+        self.load_mode = load_mode
         self.client = bigquery.Client()
+        self.read_client = bigquery_storage.BigQueryReadClient()
         self._create_dataset()
         self.dataset_ref = bigquery.DatasetReference(self.client.project, self.dataset)
         self.log = get_dagster_logger()
@@ -22,6 +42,8 @@ class BigQueryClient:
         Create BigQuery dataset if
         it does not exist.
         """
+        from google.cloud import bigquery
+
         self.client.create_dataset(
             bigquery.Dataset(f"{self.client.project}.{self.dataset}"),
             exists_ok=True
@@ -31,31 +53,251 @@ class BigQueryClient:
         external_config: bigquery.ExternalConfig, table_name: str):
         """
         Create BigQuery external table to allow
-        dbt to query the data lake
+        dbt to query the data lake. An existing table
+        of the same format is updated to the passed in
+        schema and options, keeping the URIs it reads.
         """
+        from google.cloud import bigquery
+
         table_ref = bigquery.Table(self.dataset_ref.table(table_name), schema=schema)
         table_ref.external_data_configuration = external_config
         table = self.client.create_table(table_ref, exists_ok=True)
-        self.client.close()
+        existing_config = table.external_data_configuration
+        if (existing_config is not None
+            and existing_config.source_format == external_config.source_format):
+            external_config.source_uris = existing_config.source_uris
+            table.external_data_configuration = external_config
+            fields = ["external_data_configuration"]
+            if schema is not None:
+                table.schema = schema
+                fields.append("schema")
+            table = self.client.update_table(table, fields)
+        return f"{table.dataset_id}.{table.table_id}"
+
+    def get_source_uris(self, table_name: str) -> List[str]:
+        """
+        Return the GCS URIs an external table reads.
+        """
+        table = self.client.get_table(self.dataset_ref.table(table_name))
+        return list(table.external_data_configuration.source_uris)
+
+    def update_source_uris(self, table_name: str, source_uris: List[str]) -> str:
+        """
+        Point an external table at a new set of GCS
+        URIs, switching readers to them in one update.
+        """
+        table = self.client.get_table(self.dataset_ref.table(table_name))
+        external_config = table.external_data_configuration
+        external_config.source_uris = source_uris
+        table.external_data_configuration = external_config
+        table = self.client.update_table(table, ["external_data_configuration"])
+        self.log.info(f"Switched {table_name} to {source_uris}")
         return f"{table.dataset_id}.{table.table_id}"
 
-    def download_table(self, table_reference: str) -> pd.DataFrame:
+    def load_table(self, table_name: str, source_uris: List[str],
+        source_format: str, schema: List = None, clustering_fields: List[str] = None,
+        hive_partitioning_prefix: str = None, merge_key: str = None) -> str:
+        """
+        Run a batch load job from GCS into a native table
+        partitioned by ingestion date and clustered by the
+        passed in fields.
+
+        Without a merge key the load truncates the table so
+        it holds only this load, in today's partition. With
+        a merge key, a SQL expression formatted with the
+        table alias, the files are loaded to a staging table
+        and merged into the table, updating matched rows.
+        """
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=source_format,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        if schema is not None:
+            job_config.schema = schema
+            job_config.ignore_unknown_values = True
+        if hive_partitioning_prefix is not None:
+            hive_partitioning = bigquery.external_config.HivePartitioningOptions()
+            hive_partitioning.mode = "AUTO"
+            hive_partitioning.source_uri_prefix = hive_partitioning_prefix
+            job_config.hive_partitioning = hive_partitioning
+
+        table = self.dataset_ref.table(table_name)
+        if merge_key is None or not self._table_exists(table):
+            job_config.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY)
+            job_config.clustering_fields = clustering_fields
+            destination = table
+        else:
+            destination = self.dataset_ref.table(f"{table_name}__staging")
+
+        self.client.load_table_from_uri(
+            source_uris, destination, job_config=job_config).result()
+        self.log.info(f"Loaded {source_uris} into {destination.table_id}")
+
+        if destination != table:
+            self._merge(table, destination, merge_key)
+
+        return f"{table.dataset_id}.{table.table_id}"
+
+    def _table_exists(self, table: bigquery.TableReference) -> bool:
+        from google.cloud import exceptions
+
+        try:
+            self.client.get_table(table)
+            return True
+        except exceptions.NotFound:
+            return False
+
+    def _merge(self, table: bigquery.TableReference,
+        staging_table: bigquery.TableReference, merge_key: str):
         """
-        Download table and return the resulting QueryJob.
+        Merge the staging table into the table, updating
+        rows whose merge key matches and inserting the rest
+        into today's partition.
         """
+        columns = [field.name for field in self.client.get_table(staging_table).schema]
+        query = (
+            f"MERGE `{table.project}.{table.dataset_id}.{table.table_id}` AS target "
+            f"USING `{staging_table.project}.{staging_table.dataset_id}.{staging_table.table_id}` AS source "
+            f"ON {merge_key.format(alias='target')} = {merge_key.format(alias='source')} "
+            "WHEN MATCHED THEN UPDATE SET "
+            + ", ".join(f"{column} = source.{column}" for column in columns)
+            + " WHEN NOT MATCHED THEN INSERT ROW"
+        )
+        self.client.query(query).result()
+        self.client.delete_table(staging_table, not_found_ok=True)
+        self.log.info(f"Merged {staging_table.table_id} into {table.table_id}")
+
+    def _create_read_session(self, table_reference: str, selected_fields: List[str] = None,
+        row_restriction: str = None, max_streams: int = 8) -> bigquery_storage.types.ReadSession:
+        """
+        Open a Storage Read API session returning arrow
+        batches of the selected columns of rows matching
+        the restriction, split across up to max_streams.
+        """
+        from google.cloud import bigquery, bigquery_storage
+
         table = bigquery.TableReference.from_string(
             f"{self.client.project}.{table_reference}")
-        rows = self.client.list_rows(table)
-        df = rows.to_dataframe(date_as_object=True)
+        read_session = bigquery_storage.types.ReadSession(
+            table=f"projects/{table.project}/datasets/{table.dataset_id}/tables/{table.table_id}",
+            data_format=bigquery_storage.types.DataFormat.ARROW,
+            read_options=bigquery_storage.types.ReadSession.TableReadOptions(
+                selected_fields=selected_fields or [],
+                row_restriction=row_restriction or ""
+            )
+        )
+        return self.read_client.create_read_session(
+            parent=f"projects/{self.client.project}",
+            read_session=read_session,
+            max_stream_count=max_streams
+        )
+
+    def _read_stream(self, session: bigquery_storage.types.ReadSession,
+        stream_name: str, batches: queue.Queue, stop: threading.Event):
+        """
+        Put the record batches of one stream on the queue,
+        followed by a done marker or the error that ended it.
+        """
+        try:
+            for page in self.read_client.read_rows(stream_name).rows(session).pages:
+                if not _put(batches, page.to_arrow(), stop):
+                    return
+            _put(batches, _STREAM_DONE, stop)
+        except Exception as e:
+            _put(batches, e, stop)
+
+    def _read_session_batches(
+        self, session: bigquery_storage.types.ReadSession) -> Iterator[pa.RecordBatch]:
+        """
+        Read every stream of a session in parallel, yielding
+        batches as they arrive. Readers block once the queue
+        is full so at most READ_QUEUE_SIZE batches are held.
+        """
+        if not session.streams:
+            return
 
-        self.log.info(f"Downloaded {len(df)} rows from table {table_reference}")
+        batches = queue.Queue(maxsize=READ_QUEUE_SIZE)
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+            for stream in session.streams:
+                executor.submit(self._read_stream, session, stream.name, batches, stop)
+            try:
+                done = 0
+                while done < len(session.streams):
+                    batch = batches.get()
+                    if batch is _STREAM_DONE:
+                        done += 1
+                    elif isinstance(batch, Exception):
+                        raise batch
+                    else:
+                        yield batch
+            finally:
+                stop.set()
+
+    def read_batches(self, table_reference: str, selected_fields: List[str] = None,
+        row_restriction: str = None, max_streams: int = 8) -> Iterator[pa.RecordBatch]:
+        """
+        Stream a table as arrow record batches through the
+        BigQuery Storage Read API, reading only the selected
+        columns of rows matching the row restriction, a SQL
+        predicate such as "course_id = 1".
+        """
+        session = self._create_read_session(
+            table_reference, selected_fields, row_restriction, max_streams)
+        yield from self._read_session_batches(session)
+
+    def download_table(self, table_reference: str, selected_fields: List[str] = None,
+        row_restriction: str = None, max_streams: int = 8) -> pd.DataFrame:
+        """
+        Download table, or the selected columns of rows
+        matching the row restriction, and return it as a
+        DataFrame.
+        """
+        import pyarrow as pa
+
+        session = self._create_read_session(
+            table_reference, selected_fields, row_restriction, max_streams)
+        schema = pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+        table = pa.Table.from_batches(self._read_session_batches(session), schema=schema)
+        # release arrow buffers as columns are converted
+        # rather than holding both copies at once
+        df = table.to_pandas(date_as_object=True, split_blocks=True, self_destruct=True)
+        del table
+
+        self.log.info(f"Downloaded {len(df)} rows from table {table_reference} "
+            f"over {len(session.streams)} streams")
 
         return df
 
 
+def _put(batches: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Put an item on a bounded queue, giving up and
+    returning False once the reader has stopped.
+    """
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
 @resource(
     config_schema={
         "dataset": str,
+        "load_mode": Field(
+            Enum("LoadMode", [EnumValue("external"), EnumValue("native")]),
+            default_value="external",
+            description=(
+                "Query the data lake through external tables or "
+                "load it into native, partitioned and clustered tables."
+            )
+        )
     },
     description="BigQuery client.",
 )
@@ -65,4 +307,5 @@ def bq_client(context):
     """
     return BigQueryClient(
         context.resource_config["dataset"],
+        load_mode=context.resource_config["load_mode"]
     )
@@ -1,80 +1,431 @@
-from typing import List, Dict
+import asyncio
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import requests
-from dagster import get_dagster_logger, resource
-from tenacity import retry, wait_exponential
+from dagster import Enum, EnumValue, Field, Noneable, get_dagster_logger, resource
+from requests.adapters import HTTPAdapter
+from resources.canvas_cache import CachedPage, ResponseCache
+from resources.canvas_reports import (REPORT_DONE_STATUSES,
+                                      REPORT_MISSING_FIELDS,
+                                      ProvisioningReports, ReportFailed,
+                                      report_csvs)
+from resources.canvas_throttle import (RATE_LIMIT_STATUSES, AdaptiveThrottle,
+                                       RateLimitExceeded, SharedThrottle,
+                                       is_rate_limited)
+from resources.hot_path_metrics import HotPathMetrics, record_retry
+from tenacity import (retry, retry_if_exception_type, stop_after_attempt,
+                      wait_exponential)
+
+# course level endpoints that can be fetched for
+# a batch of courses by the async client
+COURSE_ENDPOINTS = {
+    "assignments": "/assignments?page=1&per_page=100",
+    "enrollments": "/enrollments?page=1&per_page=100&include=current_points",
+    "sections": "/sections?page=1&per_page=100&include=total_students"
+}
+
+# maximum assignment ids passed to a single
+# students/submissions request
+SUBMISSIONS_ASSIGNMENT_BATCH_SIZE = 50
+
+# seconds between polls of a provisioning report,
+# doubled after each poll up to the maximum
+REPORT_POLL_MIN_SECONDS = 2
+REPORT_POLL_MAX_SECONDS = 60
+
+
+def _page_number(url: str) -> Optional[int]:
+    """
+    Return the numeric page query parameter of a URL
+    or None for bookmark style cursors.
+    """
+    page = dict(parse_qsl(urlsplit(url).query)).get("page", "")
+    return int(page) if page.isdigit() else None
+
+
+def next_page_url(links: Dict) -> Optional[str]:
+    """
+    Return the URL of the next page to walk
+    from a response's parsed Link header.
+    """
+    current = links.get("current", {}).get("url")
+    if "next" in links and links["next"]["url"] != current:
+        return links["next"]["url"]
+    elif "last" in links and links["last"]["url"] != current:
+        return links["last"]["url"]
+    return None
+
+
+def page_range_urls(links: Dict) -> List[str]:
+    """
+    Return the URLs of every page after the current one
+    when the Link header exposes numbered pages. An empty
+    list means the pages must be walked sequentially.
+    """
+    if "current" not in links or "last" not in links:
+        return list()
+    current_page = _page_number(links["current"]["url"])
+    last_page = _page_number(links["last"]["url"])
+    if current_page is None or last_page is None:
+        return list()
+
+    last_url = urlsplit(links["last"]["url"])
+    query = parse_qsl(last_url.query)
+    urls = list()
+    for page in range(current_page + 1, last_page + 1):
+        page_query = [(k, str(page) if k == "page" else v) for k, v in query]
+        urls.append(urlunsplit(last_url._replace(query=urlencode(page_query))))
+
+    return urls
+
+
+def _cached_response(url: str, cached: CachedPage) -> requests.Response:
+    """
+    Build a 200 response from a cached page
+    so callers can treat it like a fresh one.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = cached.body
+    if cached.link:
+        response.headers["Link"] = cached.link
+    return response
 
 
 class CanvasApiClient:
     """Class for interacting with Canvas API"""
 
 
-    def __init__(self, api_base_url, api_access_token, account_id):
+    def __init__(self, api_base_url, api_access_token, account_id,
+        pool_connections=1, pool_maxsize=10, keep_alive=True, max_in_flight=32,
+        page_concurrency=4, rate_limit_low_water_mark=100.0, cache: ResponseCache = None,
+        throttle: AdaptiveThrottle = None, reports: ProvisioningReports = None,
+        report_timeout=1800):
         self.api_base_url=api_base_url
         self.api_access_token=api_access_token
         self.account_id=account_id
+        self.keep_alive=keep_alive
+        self.max_in_flight=max_in_flight
+        self.page_concurrency=page_concurrency
+        self.throttle=throttle or AdaptiveThrottle(
+            max_in_flight, low_water_mark=rate_limit_low_water_mark)
+        self.cache=cache
+        self.checkpoints=None
+        self.reports=reports
+        self.report_timeout=report_timeout
+        self.metrics=HotPathMetrics(keep_totals=True)
         self.log=get_dagster_logger()
+        self.session=self._create_session(
+            pool_connections, pool_maxsize, keep_alive)
+
+
+    def _create_session(self, pool_connections: int,
+        pool_maxsize: int, keep_alive: bool) -> requests.Session:
+        """
+        Create a requests session backed by a
+        connection pool so TCP and TLS handshakes
+        are reused across every API call.
+        """
+        session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True
+        )
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        session.headers.update({
+            "Authorization": f"Bearer {self.api_access_token}",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive" if keep_alive else "close"
+        })
+        return session
+
+
+    def connection_stats(self) -> Dict:
+        """
+        Return counts of requests sent, new
+        connections opened and connections reused
+        by the session's connection pools.
+        """
+        requests_sent = 0
+        new_connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            new_connections += pool.num_connections
+
+        return {
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": max(requests_sent - new_connections, 0)
+        }
+
 
+    def close(self):
+        """
+        Log connection pool stats and
+        close the underlying session.
+        """
+        self.log.info(f"Canvas API connection stats: {self.connection_stats()}")
+        self.log.info(f"Canvas API throttle stats: {self.throttle.stats()}")
+        if self.cache is not None:
+            self.log.info(f"Canvas API response cache stats: {self.cache.stats()}")
+        self.log.info(f"Canvas API hot path metrics: {self.metrics.totals.summary()}")
+        self.session.close()
+
+
+    @contextmanager
+    def resume_from(self, checkpoints):
+        """
+        Serve pages already recorded by the passed in
+        checkpoints instead of requesting them again, and
+        record every page fetched within the block.
+        """
+        self.checkpoints = checkpoints
+        try:
+            yield
+        finally:
+            self.checkpoints = None
+            if checkpoints is not None:
+                checkpoints.close()
 
-    @retry(wait=wait_exponential(multiplier=1, min=4, max=10))
-    def _call_api(self, url: str, paginate: bool):
+
+    @retry(
+        retry=retry_if_exception_type((requests.exceptions.RequestException, RateLimitExceeded)),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        stop=stop_after_attempt(8),
+        before_sleep=record_retry,
+        reraise=True
+    )
+    def _get_page(self, url: str) -> Optional[requests.Response]:
         """
         Call GET on passed in URL and
-        return response.
+        return response, or None if the resource
+        no longer exists. Requests wait on the
+        shared throttle and failures are retried
+        for this page only. Cached pages are
+        revalidated and served on a 304.
+
+        The time waiting on the throttle and the
+        latency and size of responses are recorded
+        in the hot path metrics.
         """
-        headers={"Authorization" : f"Bearer {self.api_access_token}"}
         self.log.debug(url)
-        done = False
-        records = list()
-        while not done:
-            try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()
-            except requests.exceptions.HTTPError as err:
-                self.log.warn("Failed to retrieve data")
-                # a 404 will be returned if an assignment is deleted
-                # after fetching the assignment ids and before fetching
-                # submissions
-                if response.status_code == 404:
-                    self.log.debug(response.text)
-                else:
-                    raise err
-            
-            self.log.info(f"Retrieved {len(response.json())} records")
-            if paginate:
-                records = records + response.json()
-            else:
-                return response.json()
+        if self.checkpoints is not None:
+            checkpoint = self.checkpoints.get(url)
+            if checkpoint is not None:
+                return _cached_response(url, checkpoint)
+
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {"If-None-Match": cached.etag} if cached is not None else None
+        wait_start = time.perf_counter()
+        with self.throttle.slot():
+            request_start = time.perf_counter()
+            response = self.session.get(url, headers=headers)
+            request_end = time.perf_counter()
+        self.metrics.record_url(
+            url,
+            seconds=request_end - request_start,
+            pages=1,
+            response_bytes=len(response.content),
+            throttle_wait_seconds=request_start - wait_start
+        )
+        if (response.status_code in RATE_LIMIT_STATUSES
+            and is_rate_limited(response.status_code, response.text)):
+            self.throttle.observe(response.headers, throttled=True)
+            self.log.warn("Canvas rate limit exceeded, backing off")
+            raise RateLimitExceeded(url)
+        self.throttle.observe(response.headers)
+        # a 404 will be returned if an assignment is deleted
+        # after fetching the assignment ids and before fetching
+        # submissions
+        if response.status_code == 404:
+            self.log.warn(f"Failed to retrieve data from {url}")
+            self.log.debug(response.text)
+            return None
+        response.raise_for_status()
+
+        if cached is not None and response.status_code == 304:
+            self.cache.hit(url)
+            response = _cached_response(url, cached)
+        elif self.cache is not None:
+            self.cache.put(url, response.headers, response.content)
+        if self.checkpoints is not None:
+            self.checkpoints.put(url, response.headers, response.content)
+
+        return response
+
+
+    def _decode(self, response: requests.Response):
+        """
+        Decode a response's JSON body,
+        recording the time it took.
+        """
+        with self.metrics.timer(response.url, "decode_seconds"):
+            return response.json()
+
+
+    def _get_page_records(self, url: str) -> List:
+        """
+        Return the records of a single page, or
+        an empty list if the resource no longer exists.
+        """
+        response = self._get_page(url)
+        return self._decode(response) if response is not None else list()
+
 
+    def _iter_pages(self, url: str) -> Iterator[List]:
+        """
+        Yield each page of records of the passed in URL.
+        When the first page links to a numbered last page
+        the remaining pages are fetched concurrently, holding
+        at most page_concurrency pages, otherwise the next
+        links are walked one at a time.
+        """
+        response = self._get_page(url)
+        if response is None:
+            return
+        page = self._decode(response)
+        self.log.info(f"Retrieved {len(page)} records")
+        yield page
+
+        self.log.debug(response.links)
+        page_urls = page_range_urls(response.links)
+        if page_urls:
+            with ThreadPoolExecutor(max_workers=self.page_concurrency) as executor:
+                # yield pages in order as they complete
+                futures = deque()
+                for page_url in page_urls:
+                    futures.append(executor.submit(self._get_page_records, page_url))
+                    if len(futures) >= self.page_concurrency:
+                        page = futures.popleft().result()
+                        self.log.info(f"Retrieved {len(page)} records")
+                        yield page
+                while futures:
+                    page = futures.popleft().result()
+                    self.log.info(f"Retrieved {len(page)} records")
+                    yield page
+            return
+
+        url = next_page_url(response.links)
+        while url:
+            response = self._get_page(url)
+            if response is None:
+                return
+            page = self._decode(response)
+            self.log.info(f"Retrieved {len(page)} records")
+            yield page
             self.log.debug(response.links)
-            if "next" in response.links and response.links["current"]["url"] != response.links["next"]["url"]:
-                url = response.links["next"]["url"]
-            elif "last" in response.links and response.links["current"]["url"] != response.links["last"]["url"]:
-                url = response.links["last"]["url"]
-            else:
-                done = True
-        
-        return records
+            url = next_page_url(response.links)
 
 
-    def get_assignments(self, course_id: int) -> List:
+    def _call_api(self, url: str, paginate: bool, stream=False):
         """
-        Get assignment data from Canvas API
-        and return JSON
+        Call GET on passed in URL and
+        return response. Paginated responses are
+        returned as a list of all records, or as
+        an iterator of records when streaming.
         """
-        endpoint_url = (
+        if not paginate:
+            response = self._get_page(url)
+            page = self._decode(response) if response is not None else dict()
+            self.log.info(f"Retrieved {len(page)} records")
+            return page
+
+        records = (record for page in self._iter_pages(url) for record in page)
+        return records if stream else list(records)
+
+
+    def _course_endpoint_url(self, endpoint: str, course_id: int) -> str:
+        """
+        Return the first page URL of a
+        course level endpoint.
+        """
+        return (
             f"{self.api_base_url}"
             f"/api/v1/courses/{course_id}"
-            "/assignments?page=1&per_page=100"
+            f"{COURSE_ENDPOINTS[endpoint]}"
         )
-        return self._call_api(endpoint_url, True)
 
 
-    def get_courses(self, term_id: int) -> List:
+    def get_assignments(self, course_id: int, stream=False) -> List:
+        """
+        Get assignment data from Canvas API
+        and return JSON
+        """
+        endpoint_url = self._course_endpoint_url("assignments", course_id)
+        return self._call_api(endpoint_url, True, stream)
+
+
+    def get_course_batch(self, course_ids: Iterable[int],
+        endpoints: Iterable[str] = ("enrollments", "sections", "assignments")) -> Dict:
+        """
+        Concurrently get course level endpoint data
+        for a batch of courses using the async client
+        and return a dict keyed by endpoint and course id.
+
+        ie. {"sections": {course_id: List of records}}
+        """
+        from resources.canvas_async_api import AsyncCanvasApiClient
+
+        results = {endpoint: dict() for endpoint in endpoints}
+        urls = dict()
+        for endpoint in endpoints:
+            for course_id in course_ids:
+                records = self._report_records(endpoint, course_id)
+                if records is not None:
+                    results[endpoint][course_id] = records
+                else:
+                    urls[(endpoint, course_id)] = self._course_endpoint_url(endpoint, course_id)
+        if not urls:
+            return results
+
+        async def _fetch_all():
+            async with AsyncCanvasApiClient(
+                self.api_access_token,
+                throttle=self.throttle,
+                cache=self.cache,
+                metrics=self.metrics,
+                max_in_flight=self.max_in_flight,
+                keep_alive=self.keep_alive
+            ) as client:
+                return await client.fetch_all(urls)
+
+        for (endpoint, course_id), records in asyncio.run(_fetch_all()).items():
+            results[endpoint][course_id] = records
+
+        return results
+
+
+    def get_courses(self, term_id: int, stream=False) -> List:
         """
         Get courses data from Canvas API
         and return JSON
+
+        When provisioning reports are enabled, the term's
+        courses, sections and enrollments are extracted from
+        a single report instead, falling back to crawling
+        the REST API if the report fails.
         """
+        if self.reports is not None:
+            try:
+                return self._land_provisioning_report(term_id)
+            except (ReportFailed, requests.exceptions.RequestException) as e:
+                self.log.warn(
+                    f"Provisioning report for term {term_id} failed, "
+                    f"crawling the REST API instead: {e}")
+
         endpoint_url = (
             f"{self.api_base_url}"
             f"/api/v1/accounts/{self.account_id}/courses"
@@ -84,43 +435,55 @@ class CanvasApiClient:
             "&include[]=total_students"
             "&include[]=teachers"
         )
-        return self._call_api(endpoint_url, True)
+        return self._call_api(endpoint_url, True, stream)
 
 
-    def get_enrollments(self, course_id: int) -> List:
+    def get_enrollments(self, course_id: int, stream=False) -> List:
         """
         Get enrollment data from Canvas API
         and return JSON
         """
-        endpoint_url = (
-            f"{self.api_base_url}"
-            f"/api/v1/courses/{course_id}"
-            "/enrollments?page=1&per_page=100"
-            "&include=current_points"
-        )
-        return self._call_api(endpoint_url, True)
+        records = self._report_records("enrollments", course_id)
+        if records is not None:
+            return iter(records) if stream else records
+        endpoint_url = self._course_endpoint_url("enrollments", course_id)
+        return self._call_api(endpoint_url, True, stream)
 
 
-    def get_sections(self, course_id: int) -> List:
+    def get_sections(self, course_id: int, stream=False) -> List:
         """
         Get section data from Canvas API
         and return JSON
         """
-        endpoint_url = (
-            f"{self.api_base_url}"
-            f"/api/v1/courses/{course_id}"
-            "/sections?page=1&per_page=100"
-            "&include=total_students"
-        )
-        return self._call_api(endpoint_url, True)
+        records = self._report_records("sections", course_id)
+        if records is not None:
+            return iter(records) if stream else records
+        endpoint_url = self._course_endpoint_url("sections", course_id)
+        return self._call_api(endpoint_url, True, stream)
 
 
     def get_submissions(self, course_id: str,
-        assignment_id: str, assignment_type: str, pagination=True) -> List:
+        assignment_id: str = None, assignment_type: str = "assignment",
+        pagination=True, bulk=False, assignment_ids: List[str] = None,
+        since: str = None, stream=False) -> List:
         """
         Get submission data from Canvas API
         and return JSON
+
+        When bulk is set, every submission in the course,
+        including quiz assignment submissions, is pulled from
+        the students/submissions endpoint instead of one
+        assignment at a time. assignment_ids optionally limits
+        the bulk pull to specific assignments and since
+        limits it to submissions submitted or graded after
+        that ISO 8601 timestamp. Set stream to get an
+        iterator of records rather than a list.
         """
+        if bulk and since:
+            return self._get_bulk_submissions_since(course_id, since, assignment_ids)
+        elif bulk:
+            return self._get_bulk_submissions(course_id, assignment_ids, stream=stream)
+
         if assignment_type == "assignment":
             endpoint_url = (
                 f"{self.api_base_url}"
@@ -136,7 +499,127 @@ class CanvasApiClient:
                 "?page=1&per_page=100"
             )
 
-        return self._call_api(endpoint_url, pagination)
+        return self._call_api(endpoint_url, pagination, stream and pagination)
+
+
+    def _get_bulk_submissions_since(self, course_id: str, since: str,
+        assignment_ids: List[str] = None) -> List:
+        """
+        Get submissions submitted or graded after since.
+        Canvas applies submitted_since and graded_since
+        together, so each is requested separately and
+        the results are deduplicated by submission id.
+        """
+        records = dict()
+        for filter_name in ("submitted_since", "graded_since"):
+            for record in self._get_bulk_submissions(
+                course_id, assignment_ids, f"&{filter_name}={since}"):
+                records[record["id"]] = record
+
+        return list(records.values())
+
+
+    def _get_bulk_submissions(self, course_id: str,
+        assignment_ids: List[str] = None, filters: str = "", stream=False) -> List:
+        """
+        Get all submissions for a course with as few
+        requests as possible, batching assignment ids
+        to keep URLs within length limits.
+        """
+        endpoint_url = (
+            f"{self.api_base_url}"
+            f"/api/v1/courses/{course_id}"
+            "/students/submissions"
+            "?page=1&per_page=100"
+            "&student_ids[]=all"
+            f"{filters}"
+        )
+        if assignment_ids is None:
+            return self._call_api(endpoint_url, True, stream)
+
+        records = chain.from_iterable(
+            self._call_api(
+                endpoint_url + "".join(f"&assignment_ids[]={id}" for id in
+                    assignment_ids[i:i+SUBMISSIONS_ASSIGNMENT_BATCH_SIZE]),
+                True,
+                True
+            )
+            for i in range(0, len(assignment_ids), SUBMISSIONS_ASSIGNMENT_BATCH_SIZE)
+        )
+        return records if stream else list(records)
+
+
+    def _report_records(self, endpoint: str, course_id: int) -> Optional[List]:
+        """
+        Return a course's records landed from a
+        provisioning report, or None if they must be
+        crawled from the REST API.
+        """
+        if self.reports is None:
+            return None
+        return self.reports.records(endpoint, course_id)
+
+
+    def _land_provisioning_report(self, term_id: int) -> List:
+        """
+        Run a term's provisioning report, land the
+        course level endpoints served from reports by
+        course and return its courses.
+        """
+        entities = self.reports.entities()
+        report_file = self._run_provisioning_report(term_id, entities)
+        with report_file:
+            courses = self.reports.land(report_csvs(report_file, entities))
+        self.log.info(f"Retrieved {len(courses)} courses from the term {term_id} provisioning report")
+        return courses
+
+
+    def _run_provisioning_report(self, term_id: int, entities: List[str]):
+        """
+        Start an account provisioning report of the passed
+        in entities for a term, poll it with exponential
+        backoff until it completes and return its
+        downloaded file.
+        """
+        report_url = (
+            f"{self.api_base_url}"
+            f"/api/v1/accounts/{self.account_id}/reports/provisioning_csv"
+        )
+        parameters = {"parameters[enrollment_term_id]": str(term_id)}
+        parameters.update({f"parameters[{entity}]": "true" for entity in entities})
+        with self.throttle.slot():
+            response = self.session.post(report_url, data=parameters)
+        self.throttle.observe(response.headers)
+        response.raise_for_status()
+        report = response.json()
+
+        deadline = time.monotonic() + self.report_timeout
+        delay = REPORT_POLL_MIN_SECONDS
+        while report.get("status") not in REPORT_DONE_STATUSES:
+            if time.monotonic() + delay > deadline:
+                raise ReportFailed(f"report {report.get('id')} did not complete in time")
+            time.sleep(delay)
+            delay = min(delay * 2, REPORT_POLL_MAX_SECONDS)
+            response = self._get_page(f"{report_url}/{report['id']}")
+            if response is None:
+                raise ReportFailed(f"report {report['id']} no longer exists")
+            report = self._decode(response)
+            self.log.debug(f"Provisioning report {report['id']} is {report.get('status')}")
+
+        file_url = (report.get("attachment") or dict()).get("url") or report.get("file_url")
+        if report["status"] != "complete" or not file_url:
+            raise ReportFailed(f"report {report['id']} ended as {report['status']}")
+
+        # a real file, as zipfile and TextIOWrapper need
+        # seekable(), which SpooledTemporaryFile lacks before 3.11
+        report_file = tempfile.TemporaryFile()
+        with self.throttle.slot():
+            with self.session.get(file_url, stream=True) as download:
+                download.raise_for_status()
+                for chunk in download.iter_content(chunk_size=1024 * 1024):
+                    report_file.write(chunk)
+        report_file.seek(0)
+        return report_file
 
 
     def get_terms(self) -> List:
@@ -159,13 +642,97 @@ class CanvasApiClient:
     config_schema={
         "api_base_url": str,
         "api_access_token": str,
-        "account_id": str
+        "account_id": str,
+        "pool_connections": Field(int, default_value=1,
+            description="Number of host connection pools to cache."),
+        "pool_maxsize": Field(int, default_value=10,
+            description="Maximum number of connections kept open per host."),
+        "keep_alive": Field(bool, default_value=True,
+            description="Reuse connections across requests."),
+        "max_in_flight": Field(int, default_value=32,
+            description="Maximum concurrent requests made by the async client."),
+        "page_concurrency": Field(int, default_value=4,
+            description="Maximum pages of a single endpoint fetched concurrently."),
+        "rate_limit_low_water_mark": Field(float, default_value=100.0,
+            description="X-Rate-Limit-Remaining below which concurrency is halved."),
+        "response_cache_dir": Field(Noneable(str), default_value=None,
+            description="Directory caching responses for ETag revalidation, unset to disable."),
+        "response_cache_max_bytes": Field(int, default_value=1024 ** 3,
+            description="Size of cached response bodies above which entries are evicted."),
+        "shared_budget_dir": Field(Noneable(str), default_value=None,
+            description=(
+                "Directory of a SQLite database through which every step of a run "
+                "shares one request budget, unset to throttle each step on its own."
+            )),
+        "shared_max_in_flight": Field(int, default_value=64,
+            description="Maximum concurrent requests across every step sharing the budget."),
+        "provisioning_report_dir": Field(Noneable(str), default_value=None,
+            description=(
+                "Directory term provisioning reports are landed in. When set, courses, "
+                "and any provisioning_report_endpoints, are extracted from one "
+                "report per term, unset to crawl them from the REST API."
+            )),
+        "provisioning_report_endpoints": Field(
+            [Enum("ReportEndpoint", [EnumValue("sections"), EnumValue("enrollments")])],
+            default_value=[],
+            description=(
+                "Course level endpoints also extracted from provisioning reports. "
+                "Reports lack some REST fields, sections their created_at and "
+                "restrict_enrollments_to_section_dates and enrollments their "
+                "created_at, updated_at and grades, which are left out."
+            )),
+        "provisioning_report_timeout": Field(int, default_value=1800,
+            description="Seconds to wait for a provisioning report before crawling the REST API.")
     },
     description="A Canvas LMS client that retrieves data from their restful API.",
 )
 def canvas_api_resource_client(context):
-    return CanvasApiClient(
+    cache = None
+    if context.resource_config["response_cache_dir"]:
+        cache = ResponseCache(
+            context.resource_config["response_cache_dir"],
+            max_bytes=context.resource_config["response_cache_max_bytes"]
+        )
+    throttle = None
+    if context.resource_config["shared_budget_dir"]:
+        os.makedirs(context.resource_config["shared_budget_dir"], exist_ok=True)
+        throttle = SharedThrottle(
+            os.path.join(
+                context.resource_config["shared_budget_dir"],
+                f"{context.run_id or 'default'}.sqlite"
+            ),
+            context.resource_config["shared_max_in_flight"],
+            low_water_mark=context.resource_config["rate_limit_low_water_mark"]
+        )
+    reports = None
+    if context.resource_config["provisioning_report_dir"]:
+        reports = ProvisioningReports(
+            os.path.join(
+                context.resource_config["provisioning_report_dir"],
+                context.run_id or "default"
+            ),
+            context.resource_config["provisioning_report_endpoints"]
+        )
+        for endpoint in reports.endpoints:
+            context.log.warning(
+                f"Extracting {endpoint} from provisioning reports, without their "
+                f"{', '.join(REPORT_MISSING_FIELDS[endpoint])} fields")
+    client = CanvasApiClient(
         context.resource_config["api_base_url"],
         context.resource_config["api_access_token"],
-        context.resource_config["account_id"]
+        context.resource_config["account_id"],
+        pool_connections=context.resource_config["pool_connections"],
+        pool_maxsize=context.resource_config["pool_maxsize"],
+        keep_alive=context.resource_config["keep_alive"],
+        max_in_flight=context.resource_config["max_in_flight"],
+        page_concurrency=context.resource_config["page_concurrency"],
+        rate_limit_low_water_mark=context.resource_config["rate_limit_low_water_mark"],
+        cache=cache,
+        throttle=throttle,
+        reports=reports,
+        report_timeout=context.resource_config["provisioning_report_timeout"]
     )
+    try:
+        yield client
+    finally:
+        client.close()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, List
+
+import aiohttp
+from dagster import get_dagster_logger
+from resources.canvas_api_resource import next_page_url, page_range_urls
+from resources.canvas_cache import ResponseCache
+from resources.canvas_throttle import (RATE_LIMIT_STATUSES, AdaptiveThrottle,
+                                       RateLimitExceeded, is_rate_limited)
+from resources.hot_path_metrics import HotPathMetrics, record_retry
+from tenacity import (retry, retry_if_exception_type, stop_after_attempt,
+                      wait_exponential)
+
+
+class AsyncCanvasApiClient:
+    """
+    Class for concurrently interacting with Canvas API.
+    Used as an async context manager so a single
+    aiohttp session is shared by every request.
+    """
+
+
+    def __init__(self, api_access_token, throttle: AdaptiveThrottle = None,
+        cache: ResponseCache = None, max_in_flight=32, keep_alive=True,
+        metrics: HotPathMetrics = None):
+        self.api_access_token=api_access_token
+        self.throttle=throttle or AdaptiveThrottle(max_in_flight)
+        self.cache=cache
+        self.metrics=metrics or HotPathMetrics()
+        self.max_in_flight=max_in_flight
+        self.keep_alive=keep_alive
+        self.log=get_dagster_logger()
+        self.session=None
+        self.semaphore=None
+        self.throttle_executor=None
+
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.BoundedSemaphore(self.max_in_flight)
+        if self.throttle.blocking:
+            # a pool of its own so waiting requests do not hold
+            # up the default executor aiohttp resolves hosts on
+            self.throttle_executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_in_flight,
+                force_close=not self.keep_alive
+            ),
+            headers={
+                "Authorization": f"Bearer {self.api_access_token}",
+                "Accept-Encoding": "gzip, deflate"
+            },
+            raise_for_status=False
+        )
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        if self.throttle_executor is not None:
+            self.throttle_executor.shutdown(wait=False)
+
+
+    async def _acquire_throttle(self):
+        """
+        Wait for a throttle slot, on a thread when
+        the throttle waits on other processes so the
+        event loop keeps serving other requests.
+        """
+        if self.throttle_executor is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self.throttle_executor, self.throttle.acquire)
+            return
+        while not self.throttle.try_acquire():
+            await asyncio.sleep(0.05)
+
+
+    @retry(
+        retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError, RateLimitExceeded)),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        stop=stop_after_attempt(8),
+        before_sleep=record_retry,
+        reraise=True
+    )
+    async def _get_page(self, url: str):
+        """
+        Call GET on passed in URL, bounded by the
+        in flight semaphore and the shared throttle,
+        and return the decoded body along with the
+        response's Link header. Failures are retried
+        for this page only. Cached pages are
+        revalidated and served on a 304.
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {"If-None-Match": cached.etag} if cached is not None else None
+        async with self.semaphore:
+            wait_start = time.perf_counter()
+            await self._acquire_throttle()
+            request_start = time.perf_counter()
+            self.metrics.record_url(url, throttle_wait_seconds=request_start - wait_start)
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    if cached is not None and response.status == 304:
+                        self.metrics.record_url(
+                            url, seconds=time.perf_counter() - request_start, pages=1)
+                        self.throttle.observe(response.headers)
+                        self.cache.hit(url)
+                        return json.loads(cached.body), cached.links()
+                    return await self._read_page(url, response, request_start)
+            finally:
+                self.throttle.release()
+
+
+    async def _read_page(self, url: str, response: aiohttp.ClientResponse,
+        request_start: float):
+        """
+        Return the decoded body and Link header
+        of a response, raising on errors, and record
+        its latency, size and decode time.
+        """
+        if (response.status in RATE_LIMIT_STATUSES
+            and is_rate_limited(response.status, await response.text())):
+            self.throttle.observe(response.headers, throttled=True)
+            self.log.warn("Canvas rate limit exceeded, backing off")
+            raise RateLimitExceeded(url)
+        self.throttle.observe(response.headers)
+        if response.status == 404:
+            # a 404 will be returned if a resource is deleted
+            # after fetching the parent ids
+            self.log.warn(f"Failed to retrieve data from {url}")
+            return list(), dict()
+        response.raise_for_status()
+        content = await response.read()
+        self.metrics.record_url(
+            url,
+            seconds=time.perf_counter() - request_start,
+            pages=1,
+            response_bytes=len(content)
+        )
+        if self.cache is not None:
+            self.cache.put(url, response.headers, content)
+        with self.metrics.timer(url, "decode_seconds"):
+            body = json.loads(content)
+        links = {
+            rel: {"url": str(link["url"])}
+            for rel, link in response.links.items()
+        }
+        return body, links
+
+
+    async def _call_api(self, url: str) -> List:
+        """
+        Walk every page of the passed in URL
+        and return all records. Numbered pages are
+        fetched concurrently and reassembled in order.
+        """
+        records, links = await self._get_page(url)
+        records = list(records)
+        page_urls = page_range_urls(links)
+        if page_urls:
+            pages = await asyncio.gather(
+                *[self._get_page(page_url) for page_url in page_urls]
+            )
+            for body, _ in pages:
+                records.extend(body)
+            return records
+
+        url = next_page_url(links)
+        while url:
+            body, links = await self._get_page(url)
+            records.extend(body)
+            url = next_page_url(links)
+
+        return records
+
+
+    async def fetch_all(self, urls: Dict[Hashable, str]) -> Dict[Hashable, List]:
+        """
+        Concurrently walk each URL's pages and
+        return the records keyed like the passed in dict.
+        """
+        keys = list(urls.keys())
+        results = await asyncio.gather(
+            *[self._call_api(urls[key]) for key in keys]
+        )
+        self.log.info(f"Retrieved {sum(len(r) for r in results)} records from {len(keys)} endpoints")
+        return dict(zip(keys, results))
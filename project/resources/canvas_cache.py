@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from requests.utils import parse_header_links
+
+
+class CachedPage(NamedTuple):
+    """A cached response body with its ETag and Link header"""
+    etag: str
+    link: str
+    body: bytes
+
+    def links(self) -> Dict:
+        """
+        Return the cached Link header parsed
+        like requests' Response.links.
+        """
+        if not self.link:
+            return dict()
+        return {
+            link["rel"]: {"url": link["url"]}
+            for link in parse_header_links(self.link) if "rel" in link
+        }
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Return the last non numeric path segment of a
+    URL, ie. submissions for /courses/1/students/submissions.
+    """
+    segments = [s for s in urlsplit(url).path.split("/") if s and not s.isdigit()]
+    return segments[-1] if segments else ""
+
+
+class ResponseCache:
+    """
+    On disk cache of Canvas API responses used to
+    revalidate requests with If-None-Match. Entries are
+    keyed by a hash of the URL and point at bodies stored
+    under a hash of their content, so identical pages are
+    stored once. Bodies no longer pointed at and the least
+    recently used entries are evicted once the bodies
+    exceed max_bytes.
+    """
+
+    # fraction of max_bytes evicted down to, so
+    # entries are not scanned on every put
+    EVICT_TO = 0.9
+
+    def __init__(self, directory: str, max_bytes: int = 1024 ** 3):
+        self.entries_dir = os.path.join(directory, "entries")
+        self.bodies_dir = os.path.join(directory, "bodies")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = sum(
+            entry.stat().st_size for entry in os.scandir(self.bodies_dir))
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+
+    def _entry_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.entries_dir, f"{key}.json")
+
+
+    def _write(self, path: str, data: bytes):
+        """
+        Write a file atomically so concurrent
+        readers never see a partial file.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """
+        Return the cached page of a URL, or None when
+        it is not cached or its body has been evicted.
+        """
+        entry_path = self._entry_path(url)
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            with open(os.path.join(self.bodies_dir, entry["digest"]), "rb") as f:
+                body = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return CachedPage(entry["etag"], entry["link"], body)
+
+
+    def hit(self, url: str):
+        """
+        Record a 304 served from the cache and
+        mark the entry as recently used.
+        """
+        try:
+            os.utime(self._entry_path(url))
+        except OSError:
+            pass
+        with self.lock:
+            self.hits[endpoint_name(url)] += 1
+
+
+    def put(self, url: str, headers: Dict, body: bytes):
+        """
+        Record a full response, caching its body
+        when Canvas returned an ETag for it.
+        """
+        with self.lock:
+            self.misses[endpoint_name(url)] += 1
+
+        etag = headers.get("ETag")
+        if not etag:
+            return
+
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = os.path.join(self.bodies_dir, digest)
+        if not os.path.exists(body_path):
+            self._write(body_path, body)
+            with self.lock:
+                self.size += len(body)
+        entry = {"url": url, "etag": etag, "link": headers.get("Link", ""), "digest": digest}
+        self._write(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+
+    def evict(self):
+        """
+        Remove bodies no entry points at, left behind when
+        a URL's body changes, then the least recently used
+        entries until the cache is comfortably within max_bytes.
+        A body is removed with the last entry pointing at it.
+        """
+        with self.lock:
+            entries = sorted(
+                (e for e in os.scandir(self.entries_dir) if not e.name.startswith(".")),
+                key=lambda e: e.stat().st_mtime)
+            digests = dict()
+            refs = defaultdict(int)
+            for entry in entries:
+                try:
+                    with open(entry.path) as f:
+                        digests[entry.path] = json.load(f)["digest"]
+                except (OSError, ValueError, KeyError):
+                    continue
+                refs[digests[entry.path]] += 1
+
+            # a body removed before a concurrent put writes its
+            # entry only turns that entry into a miss, partly
+            # written files are left to their writer
+            self.size = 0
+            for body in os.scandir(self.bodies_dir):
+                try:
+                    if body.name in refs or body.name.startswith("."):
+                        self.size += body.stat().st_size
+                    else:
+                        os.remove(body.path)
+                except OSError:
+                    continue
+
+            for entry in entries:
+                if self.size <= self.max_bytes * self.EVICT_TO:
+                    break
+                digest = digests.get(entry.path)
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+                if digest is None:
+                    continue
+                refs[digest] -= 1
+                if refs[digest] > 0:
+                    continue
+                body_path = os.path.join(self.bodies_dir, digest)
+                try:
+                    size = os.path.getsize(body_path)
+                    os.remove(body_path)
+                except OSError:
+                    continue
+                self.size -= size
+
+
+    def stats(self) -> Dict:
+        """
+        Return cache hits and misses by endpoint.
+        """
+        with self.lock:
+            return {
+                endpoint: {"hits": self.hits[endpoint], "misses": self.misses[endpoint]}
+                for endpoint in sorted(set(self.hits) | set(self.misses))
+            }
@@ -0,0 +1,119 @@
+import glob
+import os
+import re
+from typing import Dict, Iterable, Iterator, List
+
+from resources.canvas_schemas import LANDING_SCHEMAS
+
+# dbt models, relative to the dbt project,
+# that read the landed JSON
+STAGING_MODELS_DIR = os.path.join("models", "staging", "canvas")
+
+# fields the pipeline itself reads from extracts, to
+# generate ids, filter, schedule and partition records,
+# and those it adds to records
+PIPELINE_PATHS = {
+    "assignments": ["$.id", "$.course_id", "$.is_quiz_assignment", "$.quiz_id", "$.updated_at"],
+    "courses": ["$.id", "$.total_students", "$.enrollment_term_id"],
+    "enrollments": ["$.id", "$.course_id"],
+    "sections": ["$.id", "$.course_id"],
+    "submissions": ["$.id", "$.course_id", "$._extracted_at"],
+    "terms": ["$.id", "$.start_at"]
+}
+
+SOURCE_PATTERN = re.compile(r"source\(\s*['\"]raw_sources['\"]\s*,\s*['\"]canvas_(\w+)['\"]\s*\)")
+JSON_PATH_PATTERN = re.compile(
+    r"JSON_(?:EXTRACT_SCALAR|EXTRACT|VALUE|QUERY)\(\s*data\s*,\s*['\"](\$[^'\"]*)['\"]",
+    re.IGNORECASE
+)
+
+
+def dbt_model_paths(models_dir: str) -> Dict[str, List[str]]:
+    """
+    Return the JSON paths each endpoint's staging
+    models read from the data column, by parsing the
+    JSON functions of every model reading a raw source.
+    Endpoints without a model are not included.
+    """
+    paths = dict()
+    for model_path in sorted(glob.glob(os.path.join(models_dir, "*.sql"))):
+        with open(model_path) as f:
+            sql = f.read()
+        model_paths = JSON_PATH_PATTERN.findall(sql)
+        for folder_name in SOURCE_PATTERN.findall(sql):
+            paths.setdefault(folder_name, list()).extend(model_paths)
+    return paths
+
+
+def path_tree(paths: Iterable[str]) -> Dict:
+    """
+    Return a tree of the keys selected by JSON paths,
+    where True selects a key's whole value. Paths indexing
+    into arrays select the whole array.
+
+    ie. ["$.id", "$.term.name"] -> {"id": True, "term": {"name": True}}
+    """
+    tree = dict()
+    for path in paths:
+        keys = path[2:].split("[")[0].split(".") if path.startswith("$.") else list()
+        if not keys or not keys[0]:
+            # the root is selected, keep everything
+            return True
+        node = tree
+        for key in keys[:-1]:
+            if node.get(key) is True:
+                break
+            node = node.setdefault(key, dict())
+        else:
+            node[keys[-1]] = True
+    return tree
+
+
+def project(value, tree):
+    """
+    Return the parts of a decoded JSON value
+    selected by a path tree.
+    """
+    if tree is True or not isinstance(value, dict):
+        return value
+    return {
+        key: project(value[key], subtree)
+        for key, subtree in tree.items() if key in value
+    }
+
+
+class Projection:
+    """
+    Keeps only the configured JSON paths of each endpoint's
+    records, along with the fields the pipeline reads and
+    the typed columns of parquet landing files. Endpoints
+    without paths are passed through whole.
+    """
+
+    def __init__(self, paths: Dict[str, List[str]]):
+        self.trees = {
+            folder_name: path_tree(
+                list(folder_paths)
+                + PIPELINE_PATHS.get(folder_name, list())
+                + [f"$.{name}" for name, _ in LANDING_SCHEMAS.get(folder_name, dict()).get("fields", list())]
+            )
+            for folder_name, folder_paths in paths.items()
+        }
+
+
+    @classmethod
+    def from_dbt_project(cls, project_dir: str, paths: Dict[str, List[str]] = None) -> "Projection":
+        """
+        Build a projection from the paths the dbt project's
+        staging models read, extended by any passed in paths.
+        """
+        model_paths = dbt_model_paths(os.path.join(project_dir, STAGING_MODELS_DIR))
+        for folder_name, folder_paths in (paths or dict()).items():
+            model_paths.setdefault(folder_name, list()).extend(folder_paths)
+        return cls(model_paths)
+
+
+    def apply(self, folder_name: str, records: Iterable[Dict]) -> Iterator[Dict]:
+        tree = self.trees.get(folder_name, True)
+        for record in records:
+            yield project(record, tree)
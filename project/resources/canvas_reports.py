@@ -0,0 +1,225 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import defaultdict
+from typing import IO, Dict, Iterable, Iterator, List, Optional
+
+# entities requested from each term's provisioning report
+REPORT_ENTITIES = ["courses", "sections", "enrollments"]
+
+# course level endpoints that can be served from reports
+# and the fields of their REST records reports can not
+# supply, which are missing when served from a report
+REPORT_MISSING_FIELDS = {
+    "sections": ["created_at", "restrict_enrollments_to_section_dates"],
+    "enrollments": ["created_at", "updated_at", "grades"]
+}
+
+# provisioning report status values that end polling
+REPORT_DONE_STATUSES = {"complete", "error", "deleted", "aborted"}
+
+# CSV statuses mapped to the REST API's workflow_state
+COURSE_WORKFLOW_STATES = {"active": "available"}
+
+# CSV statuses of the courses the REST API
+# lists when asked for published courses
+PUBLISHED_COURSE_STATUSES = {"active", "completed"}
+
+
+class ReportFailed(Exception):
+    """Raised when a provisioning report ends without a file"""
+
+
+def _int(value: str) -> Optional[int]:
+    return int(value) if value and value.isdigit() else None
+
+
+def _timestamp(value: str) -> Optional[str]:
+    return value or None
+
+
+def course_record(row: Dict, total_students: int) -> Dict:
+    """
+    Map a courses.csv row to the shape of
+    the REST API's course records.
+    """
+    return {
+        "id": _int(row.get("canvas_course_id")),
+        "sis_course_id": row.get("course_id") or None,
+        "course_code": row.get("short_name"),
+        "name": row.get("long_name"),
+        "account_id": _int(row.get("canvas_account_id")),
+        "enrollment_term_id": _int(row.get("canvas_term_id")),
+        "workflow_state": COURSE_WORKFLOW_STATES.get(row.get("status"), row.get("status")),
+        "start_at": _timestamp(row.get("start_date")),
+        "end_at": _timestamp(row.get("end_date")),
+        "total_students": total_students
+    }
+
+
+def section_record(row: Dict, total_students: int) -> Dict:
+    """
+    Map a sections.csv row to the shape of
+    the REST API's section records.
+    """
+    return {
+        "id": _int(row.get("canvas_section_id")),
+        "course_id": _int(row.get("canvas_course_id")),
+        "sis_section_id": row.get("section_id") or None,
+        "sis_course_id": row.get("course_id") or None,
+        "name": row.get("name"),
+        "workflow_state": row.get("status"),
+        "start_at": _timestamp(row.get("start_date")),
+        "end_at": _timestamp(row.get("end_date")),
+        "total_students": total_students
+    }
+
+
+def enrollment_record(row: Dict) -> Dict:
+    """
+    Map an enrollments.csv row to the shape of
+    the REST API's enrollment records.
+    """
+    return {
+        "id": _int(row.get("canvas_enrollment_id")),
+        "user_id": _int(row.get("canvas_user_id")),
+        "sis_user_id": row.get("user_id") or None,
+        "course_id": _int(row.get("canvas_course_id")),
+        "course_section_id": _int(row.get("canvas_section_id")),
+        "type": row.get("base_role_type"),
+        "role": row.get("role"),
+        "enrollment_state": row.get("status")
+    }
+
+
+def _is_active_student(row: Dict) -> bool:
+    return row.get("base_role_type") == "StudentEnrollment" and row.get("status") == "active"
+
+
+def report_csvs(report_file: IO[bytes], entities: List[str]) -> Dict[str, Iterator[Dict]]:
+    """
+    Return a CSV row iterator for each entity of
+    a downloaded provisioning report. Reports of more
+    than one entity are zip files of one CSV each.
+    """
+    if not zipfile.is_zipfile(report_file):
+        report_file.seek(0)
+        return {entities[0]: csv.DictReader(io.TextIOWrapper(report_file, encoding="utf-8-sig"))}
+
+    archive = zipfile.ZipFile(report_file)
+    csvs = dict()
+    for name in archive.namelist():
+        entity = next((e for e in REPORT_ENTITIES if e in os.path.basename(name)), None)
+        if entity is not None:
+            csvs[entity] = csv.DictReader(
+                io.TextIOWrapper(archive.open(name), encoding="utf-8-sig"))
+    return csvs
+
+
+class ProvisioningReports:
+    """
+    Course level records of the provisioning reports
+    landed during a run, stored as one newline delimited
+    JSON file per endpoint and course. Files of a term are
+    written to a temporary directory and moved into place
+    once the whole report is read, so a course's file is
+    either complete or missing.
+
+    Only the records of the passed in endpoints are
+    landed, as reports lack some of the fields of their
+    REST records, listed in REPORT_MISSING_FIELDS.
+    """
+
+    def __init__(self, directory: str, endpoints: Iterable[str] = ()):
+        self.directory = directory
+        self.endpoints = [endpoint for endpoint in REPORT_MISSING_FIELDS if endpoint in endpoints]
+        os.makedirs(directory, exist_ok=True)
+
+
+    def entities(self) -> List[str]:
+        """
+        Return the entities to request from a report.
+        Enrollments are always needed to count students
+        and find the courses with enrollments.
+        """
+        return [
+            entity for entity in REPORT_ENTITIES
+            if entity in ("courses", "enrollments") or entity in self.endpoints
+        ]
+
+
+    def _path(self, endpoint: str, course_id) -> str:
+        return os.path.join(self.directory, endpoint, f"{course_id}.ndjson")
+
+
+    def land(self, csvs: Dict[str, Iterable[Dict]]) -> List[Dict]:
+        """
+        Group a term report's sections and enrollments
+        by course, write those of the landed endpoints and
+        return the records of the published courses with
+        enrollments, as the REST API lists them, with their
+        active student counts.
+        """
+        course_enrollments = defaultdict(int)
+        course_students = defaultdict(int)
+        section_students = defaultdict(int)
+        grouped = {"sections": defaultdict(list), "enrollments": defaultdict(list)}
+        for row in csvs.get("enrollments", list()):
+            course_enrollments[row.get("canvas_course_id")] += 1
+            if _is_active_student(row):
+                course_students[row.get("canvas_course_id")] += 1
+                section_students[row.get("canvas_section_id")] += 1
+            if "enrollments" in self.endpoints:
+                record = enrollment_record(row)
+                grouped["enrollments"][record["course_id"]].append(json.dumps(record))
+        for row in csvs.get("sections", list()):
+            record = section_record(row, section_students[row.get("canvas_section_id")])
+            grouped["sections"][record["course_id"]].append(json.dumps(record))
+        courses = [
+            course_record(row, course_students[row.get("canvas_course_id")])
+            for row in csvs.get("courses", list())
+            if row.get("status") in PUBLISHED_COURSE_STATUSES
+            and course_enrollments[row.get("canvas_course_id")] > 0
+        ]
+
+        grouped = {endpoint: grouped[endpoint] for endpoint in self.endpoints}
+        staging_dir = tempfile.mkdtemp(dir=self.directory, prefix=".landing-")
+        try:
+            for endpoint, course_lines in grouped.items():
+                os.makedirs(os.path.join(staging_dir, endpoint))
+                os.makedirs(os.path.join(self.directory, endpoint), exist_ok=True)
+                # courses without any rows get an empty file so
+                # they are not crawled through the REST API
+                for course in courses:
+                    course_lines.setdefault(course["id"], list())
+                for course_id, lines in course_lines.items():
+                    with open(os.path.join(staging_dir, endpoint, f"{course_id}.ndjson"), "w") as f:
+                        f.write("".join(f"{line}\n" for line in lines))
+            for endpoint in grouped:
+                for file_name in os.listdir(os.path.join(staging_dir, endpoint)):
+                    os.replace(
+                        os.path.join(staging_dir, endpoint, file_name),
+                        os.path.join(self.directory, endpoint, file_name)
+                    )
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        return courses
+
+
+    def records(self, endpoint: str, course_id) -> Optional[List[Dict]]:
+        """
+        Return a course's records of an endpoint, or None
+        when they were not landed from a report.
+        """
+        if endpoint not in self.endpoints:
+            return None
+        try:
+            with open(self._path(endpoint, course_id)) as f:
+                return [json.loads(line) for line in f]
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, List
+
+# pyarrow is imported when a table is built, so steps
+# that only read the endpoint metadata do not import it
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+TIMESTAMP = "timestamp"
+
+# typed columns landed for each endpoint when writing
+# parquet, by arrow type name. The full record is always
+# kept in a data column so the JSON based dbt models keep
+# working.
+LANDING_SCHEMAS = {
+    "assignments": {
+        "partition_key": "course_id",
+        "fields": [
+            ("id", "int64"),
+            ("name", "string"),
+            ("description", "string"),
+            ("due_at", TIMESTAMP),
+            ("points_possible", "float64"),
+            ("is_quiz_assignment", "bool"),
+            ("quiz_id", "int64"),
+            ("workflow_state", "string"),
+            ("created_at", TIMESTAMP),
+            ("updated_at", TIMESTAMP)
+        ]
+    },
+    "courses": {
+        "partition_key": "enrollment_term_id",
+        "fields": [
+            ("id", "int64"),
+            ("name", "string"),
+            ("course_code", "string"),
+            ("sis_course_id", "string"),
+            ("total_students", "int64"),
+            ("workflow_state", "string"),
+            ("start_at", TIMESTAMP),
+            ("end_at", TIMESTAMP)
+        ]
+    },
+    "enrollments": {
+        "partition_key": "course_id",
+        "fields": [
+            ("id", "int64"),
+            ("user_id", "int64"),
+            ("course_section_id", "int64"),
+            ("type", "string"),
+            ("role", "string"),
+            ("enrollment_state", "string"),
+            ("created_at", TIMESTAMP),
+            ("updated_at", TIMESTAMP)
+        ]
+    },
+    "sections": {
+        "partition_key": "course_id",
+        "fields": [
+            ("id", "int64"),
+            ("sis_section_id", "string"),
+            ("sis_course_id", "string"),
+            ("name", "string"),
+            ("total_students", "int64"),
+            ("restrict_enrollments_to_section_dates", "bool"),
+            ("start_at", TIMESTAMP),
+            ("end_at", TIMESTAMP),
+            ("created_at", TIMESTAMP)
+        ]
+    },
+    "submissions": {
+        "partition_key": "course_id",
+        "fields": [
+            ("id", "int64"),
+            ("assignment_id", "int64"),
+            ("grading_period_id", "int64"),
+            ("user_id", "int64"),
+            ("grader_id", "int64"),
+            ("grade", "string"),
+            ("score", "float64"),
+            ("entered_grade", "string"),
+            ("entered_score", "float64"),
+            ("submitted_at", TIMESTAMP),
+            ("graded_at", TIMESTAMP),
+            ("posted_at", TIMESTAMP),
+            ("submission_type", "string"),
+            ("grade_matches_current_submission", "bool"),
+            ("late", "bool"),
+            ("missing", "bool"),
+            ("workflow_state", "string")
+        ]
+    },
+    "terms": {
+        "partition_key": None,
+        "fields": [
+            ("id", "int64"),
+            ("name", "string"),
+            ("sis_term_id", "string"),
+            ("start_at", TIMESTAMP),
+            ("end_at", TIMESTAMP),
+            ("workflow_state", "string")
+        ]
+    }
+}
+
+
+def _arrow_type(type_name: str) -> pa.DataType:
+    """
+    Return the arrow type of a landing schema type name.
+    """
+    import pyarrow as pa
+
+    if type_name == TIMESTAMP:
+        return pa.timestamp("us", tz="UTC")
+    return getattr(pa, "bool_" if type_name == "bool" else type_name)()
+
+
+def _coerce(value, type_name: str):
+    """
+    Convert a JSON value to the python type pyarrow
+    expects for the column, or None if it does not fit.
+    """
+    if value is None:
+        return None
+    try:
+        if type_name == TIMESTAMP:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        elif type_name == "int64":
+            return int(value)
+        elif type_name == "float64":
+            return float(value)
+        elif type_name == "bool":
+            return bool(value)
+        elif isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return str(value)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def landing_schema(folder_name: str) -> pa.Schema:
+    """
+    Return the arrow schema of an endpoint's parquet
+    files. Partition keys are encoded in the file path
+    rather than stored as a column.
+    """
+    import pyarrow as pa
+
+    return pa.schema(
+        [pa.field(name, _arrow_type(type_name))
+            for name, type_name in LANDING_SCHEMAS[folder_name]["fields"]]
+        + [pa.field("data", pa.string())]
+    )
+
+
+def partition_value(folder_name: str, record: Dict) -> str:
+    """
+    Return the hive partition value of a record,
+    or None for unpartitioned endpoints.
+    """
+    partition_key = LANDING_SCHEMAS[folder_name]["partition_key"]
+    if partition_key is None:
+        return None
+    return str(record.get(partition_key))
+
+
+def record_course_id(folder_name: str, record: Dict):
+    """
+    Return the id of the course a record belongs to,
+    or None for records that are not course level.
+    """
+    if folder_name == "courses":
+        return record.get("id")
+    return record.get("course_id")
+
+
+def records_to_table(folder_name: str, records: Iterable[Dict]) -> pa.Table:
+    """
+    Build a typed arrow table of records
+    for an endpoint's parquet landing files.
+    """
+    import pyarrow as pa
+
+    fields = LANDING_SCHEMAS[folder_name]["fields"]
+    columns = {name: list() for name, _ in fields}
+    data = list()
+    for record in records:
+        for name, type_name in fields:
+            columns[name].append(_coerce(record.get(name), type_name))
+        data.append(json.dumps(record))
+
+    arrays: List[pa.Array] = [
+        pa.array(columns[name], type=_arrow_type(type_name)) for name, type_name in fields
+    ]
+    arrays.append(pa.array(data, type=pa.string()))
+    return pa.Table.from_arrays(arrays, schema=landing_schema(folder_name))
@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# status codes of responses that may be rate limited
+RATE_LIMIT_STATUSES = (403, 429)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when Canvas answers 403 Rate Limit Exceeded"""
+
+
+class AdaptiveThrottle:
+    """
+    Concurrency limiter shared by every request a
+    CanvasApiClient makes. The limit grows additively
+    while Canvas reports plenty of X-Rate-Limit-Remaining
+    and is halved when the bucket runs low or a request
+    is throttled (AIMD).
+    """
+
+    # clock paused_until is measured against
+    clock = staticmethod(time.monotonic)
+
+    # whether acquire waits on other processes, so
+    # async callers run it off the event loop
+    blocking = False
+
+    def __init__(self, max_concurrency: int, low_water_mark: float = 100.0,
+        throttle_backoff: float = 5.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.low_water_mark = low_water_mark
+        self.throttle_backoff = throttle_backoff
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.remaining = None
+        self.paused_until = 0.0
+        self.throttled_count = 0
+        self.condition = threading.Condition()
+
+
+    def _available(self) -> bool:
+        return (
+            self.in_flight < int(self.limit)
+            and self.clock() >= self.paused_until
+        )
+
+
+    def try_acquire(self) -> bool:
+        """
+        Take a request slot without blocking and
+        return whether one was available.
+        """
+        with self.condition:
+            if self._available():
+                self.in_flight += 1
+                return True
+            return False
+
+
+    def acquire(self):
+        """
+        Block until a request slot is available.
+        """
+        with self.condition:
+            while not self._available():
+                timeout = max(self.paused_until - self.clock(), 0.05)
+                self.condition.wait(timeout=timeout)
+            self.in_flight += 1
+
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+    def observe(self, headers: Dict, throttled: bool = False):
+        """
+        Adjust the concurrency limit from the
+        rate limit headers of a response.
+        """
+        with self.condition:
+            self._adjust(headers, throttled)
+            self.condition.notify_all()
+
+
+    def _adjust(self, headers: Dict, throttled: bool):
+        remaining = _float_header(headers, "X-Rate-Limit-Remaining")
+        cost = _float_header(headers, "X-Request-Cost") or 0.0
+        if remaining is not None:
+            self.remaining = remaining
+
+        if throttled:
+            self.throttled_count += 1
+            self.limit = max(1.0, self.limit / 2)
+            self.paused_until = self.clock() + self.throttle_backoff
+        elif remaining is not None and remaining < self.low_water_mark:
+            self.limit = max(1.0, self.limit / 2)
+            # give the bucket time to leak back
+            # roughly the cost of this request
+            self.paused_until = max(self.paused_until, self.clock() + cost)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency_limit": int(self.limit),
+            "rate_limit_remaining": self.remaining,
+            "throttled_requests": self.throttled_count
+        }
+
+
+class SharedThrottle(AdaptiveThrottle):
+    """
+    AdaptiveThrottle whose state is kept in a SQLite
+    database so every process of a run, such as the steps
+    of the multiprocess executor, shares one concurrency
+    limit and one view of the token's rate limit bucket.
+    Requests in flight are counted per process, and the
+    slots of processes that exited without releasing
+    them are reclaimed every reclaim_interval seconds
+    while waiting.
+
+    Waiting requests poll with a read, only taking the
+    write lock once a slot looks available, and back off
+    from poll_interval up to max_poll_interval.
+    """
+
+    # wall clock time, comparable across processes
+    clock = staticmethod(time.time)
+
+    blocking = True
+
+    def __init__(self, path: str, max_concurrency: int, low_water_mark: float = 100.0,
+        throttle_backoff: float = 5.0, poll_interval: float = 0.05,
+        max_poll_interval: float = 1.0, reclaim_interval: float = 5.0):
+        super().__init__(max_concurrency, low_water_mark, throttle_backoff)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.reclaim_interval = reclaim_interval
+        self.reclaimed_at = self.clock()
+        self.pid = os.getpid()
+        # sqlite connections can not be shared across threads
+        self.local = threading.local()
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS budget ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), concurrency_limit REAL, "
+                "paused_until REAL, remaining REAL, throttled_count INTEGER)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                "pid INTEGER PRIMARY KEY, in_flight INTEGER)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO budget VALUES (1, ?, 0, NULL, 0)",
+                (float(self.max_concurrency),)
+            )
+            self._reclaim_slots(connection)
+
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Hold the database's write lock for the block,
+        serializing it with every other process.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+    def _load(self, connection: sqlite3.Connection):
+        (self.limit, self.paused_until, self.remaining,
+            self.throttled_count) = connection.execute(
+            "SELECT concurrency_limit, paused_until, remaining, "
+            "throttled_count FROM budget"
+        ).fetchone()
+        self.in_flight = connection.execute(
+            "SELECT COALESCE(SUM(in_flight), 0) FROM slots").fetchone()[0]
+
+
+    def _reclaim_slots(self, connection: sqlite3.Connection):
+        """
+        Release the slots held by processes
+        that are no longer running.
+        """
+        for (pid,) in connection.execute("SELECT pid FROM slots").fetchall():
+            if pid != self.pid and not _process_exists(pid):
+                connection.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+
+
+    def try_acquire(self) -> bool:
+        # check without the write lock first so
+        # waiting processes only read the database
+        self._load(self._connection())
+        if not self._available():
+            return False
+        with self._transaction() as connection:
+            self._load(connection)
+            if not self._available():
+                return False
+            connection.execute(
+                "INSERT INTO slots VALUES (?, 1) "
+                "ON CONFLICT (pid) DO UPDATE SET in_flight = in_flight + 1",
+                (self.pid,)
+            )
+            return True
+
+
+    def acquire(self):
+        poll_interval = self.poll_interval
+        while not self.try_acquire():
+            if self.clock() - self.reclaimed_at >= self.reclaim_interval:
+                self.reclaimed_at = self.clock()
+                with self._transaction() as connection:
+                    self._reclaim_slots(connection)
+            time.sleep(max(self.paused_until - self.clock(), poll_interval))
+            poll_interval = min(poll_interval * 2, self.max_poll_interval)
+
+
+    def release(self):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE slots SET in_flight = MAX(in_flight - 1, 0) WHERE pid = ?",
+                (self.pid,)
+            )
+
+
+    def observe(self, headers: Dict, throttled: bool = False):
+        with self._transaction() as connection:
+            self._load(connection)
+            self._adjust(headers, throttled)
+            connection.execute(
+                "UPDATE budget SET concurrency_limit = ?, paused_until = ?, "
+                "remaining = ?, throttled_count = ?",
+                (self.limit, self.paused_until, self.remaining, self.throttled_count)
+            )
+
+
+    def stats(self) -> Dict:
+        with self._transaction() as connection:
+            self._load(connection)
+        return super().stats()
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _float_header(headers: Dict, name: str) -> Optional[float]:
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_rate_limited(status_code: int, text: str) -> bool:
+    """
+    Canvas answers 403 with a Rate Limit Exceeded
+    body when the token's bucket is empty. Only read the
+    body of responses with RATE_LIMIT_STATUSES, so
+    successful pages are not decoded to check them.
+    """
+    if status_code == 429:
+        return True
+    return status_code == 403 and "rate limit exceeded" in text.lower()
@@ -0,0 +1,36 @@
+from dagster import Field, resource
+
+
+@resource(
+    config_schema={
+        "project_dir": str,
+        "profiles_dir": str,
+        "target": str,
+        "dbt_executable": Field(str, default_value="dbt",
+            description="Path or name of the dbt executable."),
+        "target_path": Field(str, default_value="target",
+            description="Directory dbt writes run_results.json to.")
+    },
+    description="A resource that can run dbt CLI commands.",
+)
+def dbt_cli_resource(context):
+    """
+    Initialize and return dagster_dbt's DbtCliResource.
+    dagster_dbt imports pandas, so it is only imported
+    by the steps that run dbt rather than by every step
+    that loads the job.
+    """
+    from dagster_dbt.cli.resources import DbtCliResource
+
+    return DbtCliResource(
+        executable=context.resource_config["dbt_executable"],
+        default_flags={
+            "project_dir": context.resource_config["project_dir"],
+            "profiles_dir": context.resource_config["profiles_dir"],
+            "target": context.resource_config["target"]
+        },
+        warn_error=False,
+        ignore_handled_error=False,
+        target_path=context.resource_config["target_path"],
+        logger=context.log
+    )
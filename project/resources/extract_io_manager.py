@@ -0,0 +1,182 @@
+import json
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+from dagster import (Enum, EnumValue, EventMetadataEntry, Field, IOManager,
+    Noneable, Permissive, StringSource, io_manager)
+from resources.canvas_projection import Projection
+from resources.canvas_schemas import record_course_id
+from resources.gcs_resource import landing_line
+
+# key of an extract output holding its records,
+# every other key is kept in the output's manifest
+RECORDS_KEY = "value"
+
+
+class ExtractPayload(Mapping):
+    """
+    Extract output whose records are kept on disk as
+    newline delimited JSON in the data lake's landing
+    format. Reads like the extract dict it was written
+    from, decoding the value key's records on access, while
+    lines returns the encoded records for uploading as is.
+    """
+
+    def __init__(self, path: str, extract: Dict):
+        self.path = path
+        self.extract = extract
+
+
+    def __getitem__(self, key):
+        if key == RECORDS_KEY:
+            return list(self.records())
+        return self.extract[key]
+
+
+    def __iter__(self):
+        return iter(list(self.extract) + [RECORDS_KEY])
+
+
+    def __len__(self):
+        return len(self.extract) + 1
+
+
+    def lines(self) -> Iterator[bytes]:
+        """
+        Yield each record's landing format line.
+        """
+        with open(self.path, "rb") as f:
+            yield from f
+
+
+    def records(self) -> Iterator[Dict]:
+        """
+        Yield each record decoded from its landing line.
+        """
+        for line in self.lines():
+            yield json.loads(json.loads(line)["data"])
+
+
+def write_extract(path: str, extract: Dict, projection: Optional[Projection] = None) -> Dict:
+    """
+    Write an extract's records to path as landing
+    format lines and return the rest of the extract
+    with its record count. With a projection, only
+    the fields it selects of each record are written.
+
+    Records may be a generator, which is consumed as
+    the file is written, and the rest of the extract is
+    only read afterwards so it can be filled in as the
+    records are extracted.
+    """
+    folder_name = extract["folder_name"]
+    records = extract[RECORDS_KEY]
+    if projection is not None:
+        records = projection.apply(folder_name, records)
+    record_count = 0
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(landing_line(record, record_course_id(folder_name, record)))
+            record_count += 1
+
+    manifest = {key: value for key, value in extract.items() if key != RECORDS_KEY}
+    manifest["record_count"] = record_count
+    return manifest
+
+
+class ExtractIOManager(IOManager):
+    """
+    IO manager storing extract outputs, a dict or list
+    of dicts with folder_name and value keys, as landing
+    format files instead of pickles so the load step can
+    upload them without decoding the records.
+
+    Records are projected to the fields a projection
+    selects when one is passed, or kept whole otherwise.
+    """
+
+    def __init__(self, base_dir: str, projection: Optional[Projection] = None):
+        self.base_dir = base_dir
+        self.projection = projection
+
+
+    def _get_path(self, context) -> str:
+        return os.path.join(self.base_dir, *context.get_output_identifier())
+
+
+    def handle_output(self, context, obj):
+        path = self._get_path(context)
+        os.makedirs(path, exist_ok=True)
+        extracts = obj if isinstance(obj, list) else [obj]
+        manifest = {
+            "is_list": isinstance(obj, list),
+            "extracts": [
+                write_extract(os.path.join(path, f"{i}.ndjson"), extract, self.projection)
+                for i, extract in enumerate(extracts)
+            ]
+        }
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        context.log.debug(f"Wrote {len(extracts)} extracts to {path}")
+        yield EventMetadataEntry.int(
+            sum(extract["record_count"] for extract in manifest["extracts"]), "record_count")
+
+
+    def load_input(self, context):
+        path = self._get_path(context.upstream_output)
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        payloads: List[ExtractPayload] = [
+            ExtractPayload(os.path.join(path, f"{i}.ndjson"), extract)
+            for i, extract in enumerate(manifest["extracts"])
+        ]
+        return payloads if manifest["is_list"] else payloads[0]
+
+
+@io_manager(
+    config_schema={
+        "base_dir": Field(StringSource, is_required=False),
+        "projection": Field(
+            Enum("ExtractProjection", [
+                EnumValue("passthrough"), EnumValue("paths"), EnumValue("dbt")]),
+            default_value="passthrough",
+            description=(
+                "passthrough keeps every field of each record, paths keeps only "
+                "the projection_paths of each endpoint and dbt keeps only the JSON "
+                "paths the dbt project's canvas staging models read, along with "
+                "any projection_paths."
+            )
+        ),
+        "dbt_project_dir": Field(Noneable(StringSource), default_value=None,
+            description="dbt project whose staging models the dbt projection reads."),
+        "projection_paths": Field(Permissive(), is_required=False,
+            description=(
+                "JSON paths to keep per endpoint with the paths or dbt "
+                "projections, ie. {\"courses\": [\"$.id\"]}."
+            )
+        )
+    },
+    description="Stores extracts as newline delimited JSON files on disk.",
+)
+def extract_io_manager(init_context):
+    """
+    Initialize and return ExtractIOManager()
+    """
+    config = init_context.resource_config
+    base_dir = config.get("base_dir", init_context.instance.storage_directory())
+
+    if config["projection"] == "passthrough" and config.get("projection_paths"):
+        raise ValueError("projection_paths need the paths or dbt projection")
+
+    projection = None
+    if config["projection"] == "dbt" and not config.get("dbt_project_dir"):
+        init_context.log.warning("No dbt_project_dir for the dbt projection, keeping every field")
+    elif config["projection"] == "dbt":
+        projection = Projection.from_dbt_project(
+            config["dbt_project_dir"], config.get("projection_paths"))
+    elif config["projection"] == "paths":
+        projection = Projection(config.get("projection_paths", dict()))
+    if projection is not None:
+        init_context.log.info(f"Projecting extracts of {sorted(projection.trees)}")
+    return ExtractIOManager(base_dir, projection)
@@ -1,20 +1,160 @@
+from __future__ import annotations
+
 import csv
+import gzip
+import hashlib
+import io
 import json
+import threading
+import time
 import uuid
-from typing import Dict, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from dagster import Enum, EnumValue, Field, get_dagster_logger, resource
+from resources.canvas_cache import CachedPage
+from resources.canvas_schemas import (LANDING_SCHEMAS, partition_value,
+                                      record_course_id, records_to_table)
+from resources.hot_path_metrics import HotPathMetrics
+
+# google cloud, pandas and pyarrow are imported where they
+# are used so steps that never upload do not pay for
+# importing them
+if TYPE_CHECKING:
+    import pandas as pd
+    from google.cloud import storage
+
+# maximum requests sent in a single GCS batch
+DELETE_BATCH_SIZE = 100
+
+# rows buffered per hive partition before
+# a parquet file is written
+PARQUET_ROWS_PER_FILE = 100000
+
+# page checkpoints uploaded at once, and held in
+# memory waiting to be uploaded, by each op
+CHECKPOINT_UPLOAD_CONCURRENCY = 4
+CHECKPOINT_MAX_PENDING = 16
+
+
+def landing_line(record: Dict, course_id: int = None) -> bytes:
+    """
+    Encode a record as a newline delimited JSON line
+    in the data lake's id/course_id/data landing format.
+    The record is serialized once and its text is escaped
+    into the data string rather than re-encoding a wrapper dict.
+    """
+    return (
+        '{"id": null, "course_id": '
+        + json.dumps(course_id)
+        + ', "data": '
+        + encode_basestring_ascii(json.dumps(record))
+        + '}\r\n'
+    ).encode()
+
+
+def _file_name(scope: Optional[str]) -> str:
+    """
+    Return a unique file name, prefixed
+    with the upload's scope when passed.
+    """
+    return f"{scope}-{uuid.uuid4()}" if scope else str(uuid.uuid4())
+
+
+class PageCheckpoints:
+    """
+    Durable record of the API pages an op has fetched,
+    one gzipped file per page URL. Completed pages are
+    listed once so a retried op only downloads the pages
+    it can skip requesting.
+
+    Pages are uploaded on background threads so requests
+    do not wait on GCS, with at most CHECKPOINT_MAX_PENDING
+    pages waiting at once. A page whose upload fails is
+    only requested again if the op is retried.
+    """
+
+    def __init__(self, bucket: storage.Bucket, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.completed = {blob.name for blob in bucket.list_blobs(prefix=prefix)}
+        self.executor = ThreadPoolExecutor(max_workers=CHECKPOINT_UPLOAD_CONCURRENCY)
+        self.pending = threading.BoundedSemaphore(CHECKPOINT_MAX_PENDING)
+        self.log = get_dagster_logger()
+
+
+    def _blob_name(self, url: str) -> str:
+        return f"{self.prefix}{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json.gz"
+
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """
+        Return a page recorded by an earlier attempt,
+        or None if it has not been fetched.
+        """
+        blob_name = self._blob_name(url)
+        if blob_name not in self.completed:
+            return None
+        page = json.loads(gzip.decompress(self.bucket.blob(blob_name).download_as_bytes()))
+        return CachedPage(None, page["link"], page["body"].encode("utf-8"))
+
+
+    def put(self, url: str, headers: Dict, body: bytes):
+        """
+        Record a fetched page with the Link
+        header needed to walk on from it, waiting
+        only when too many pages are pending.
+        """
+        page = {"url": url, "link": headers.get("Link", ""), "body": body.decode("utf-8")}
+        self.pending.acquire()
+        future = self.executor.submit(self._upload, self._blob_name(url), page)
+        future.add_done_callback(self._uploaded)
 
-import pandas as pd
-from dagster import get_dagster_logger, resource
-from google.cloud import exceptions, storage
+
+    def _upload(self, blob_name: str, page: Dict):
+        self.bucket.blob(blob_name).upload_from_string(
+            gzip.compress(json.dumps(page).encode("utf-8")),
+            content_type="application/gzip",
+            num_retries=3
+        )
+
+
+    def _uploaded(self, future):
+        self.pending.release()
+        if future.exception() is not None:
+            self.log.warning(f"Failed to checkpoint page: {future.exception()}")
+
+
+    def close(self):
+        """
+        Wait for pending pages to be uploaded.
+        """
+        self.executor.shutdown(wait=True)
 
 
 class GcsClient:
-    """Class for interacting with Google Cloud Storage"""
+    """
+    Class for interacting with Google Cloud Storage.
+    A storage client can be passed in, otherwise one
+    is created from the environment's credentials.
+    """
+
+    def __init__(self, gcs_bucket, gcs_prefix, compress=True,
+        chunk_size_bytes=64 * 1024 * 1024, upload_concurrency=4,
+        landing_format="json", client: storage.Client = None):
+        from google.cloud import exceptions, storage
 
-    def __init__(self, gcs_bucket, gcs_prefix):
         self.gcs_bucket = gcs_bucket
         self.gcs_prefix = gcs_prefix
-        self.client = storage.Client()
+        self.landing_format = landing_format
+        self.compress = compress
+        self.chunk_size_bytes = chunk_size_bytes
+        self.upload_concurrency = upload_concurrency
+        self.cleanup_threads = list()
+        self.metrics = HotPathMetrics(keep_totals=True)
+        self.client = client or storage.Client()
         self.log = get_dagster_logger()
         try:
             self.bucket = self.client.get_bucket(self.gcs_bucket)
@@ -41,38 +181,331 @@ class GcsClient:
         return f"gs://{self.gcs_bucket}/{self.gcs_prefix}/{file_name}"
 
 
-    def upload_json(self, folder_name, records) -> List[str]:
+    def upload_records(self, folder_name, records: Iterable[Dict], run_id: str,
+        scope: str = None) -> List[str]:
+        """
+        Upload records in the configured landing
+        format and return the GCS file paths.
+        """
+        if self.landing_format == "parquet":
+            return self.upload_parquet(folder_name, records, run_id, scope)
+        return self.upload_json(folder_name, records, run_id, scope)
+
+
+    def upload_parquet(self, folder_name, records: Iterable[Dict], run_id: str,
+        scope: str = None) -> List[str]:
+        """
+        Upload records to GCS as typed parquet files,
+        hive partitioned by the endpoint's term or course
+        id, and return the GCS file paths. Rows are buffered
+        per partition and flushed every PARQUET_ROWS_PER_FILE
+        rows so memory stays bounded.
+        """
         gcs_paths = list()
+        record_count = 0
+        with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+            uploads = deque()
+            partitions = dict()
+            for record in records:
+                partition = partition_value(folder_name, record)
+                partitions.setdefault(partition, list()).append(record)
+                record_count += 1
+                if len(partitions[partition]) >= PARQUET_ROWS_PER_FILE:
+                    uploads.append(executor.submit(
+                        self._upload_parquet_file, folder_name, run_id, scope,
+                        partition, partitions.pop(partition)))
+                    if len(uploads) >= self.upload_concurrency:
+                        gcs_paths.append(uploads.popleft().result())
+            for partition, partition_records in partitions.items():
+                uploads.append(executor.submit(
+                    self._upload_parquet_file, folder_name, run_id, scope,
+                    partition, partition_records))
+            while uploads:
+                gcs_paths.append(uploads.popleft().result())
 
-        # delete existing files
-        blobs = self.bucket.list_blobs(prefix=f"{self.gcs_prefix}/{folder_name}/")
-        for blob in blobs:
-            blob.delete()
-
-        # upload records into 10,000 record JSON chunks
-        self.log.info(f"Splitting {len(records)} into 10,000 record chunks.")
-        for i in range(0, len(records), 10000):
-            gcs_file = f"{self.gcs_prefix}/{folder_name}/{str(uuid.uuid4())}.json"
-            output = ""
-            for record in records[i:i+10000]:
-                output = output + json.dumps(record) + '\r\n'
-
-            self.bucket.blob(gcs_file).upload_from_string(
-                output,
-                content_type="application/json",
-                num_retries=3
-            )
+        self.log.info(f"Uploaded {record_count} records in {len(gcs_paths)} parquet files.")
+        self.log.debug(gcs_paths)
+        return gcs_paths
+
+
+    def _upload_parquet_file(self, folder_name: str, run_id: str, scope: Optional[str],
+        partition: str, records: List[Dict]) -> str:
+        """
+        Write records to a parquet file under
+        their hive partition and upload it.
+        """
+        import pyarrow.parquet as pq
+
+        partition_key = LANDING_SCHEMAS[folder_name]["partition_key"]
+        partition_path = f"{partition_key}={partition}/" if partition_key else ""
+        gcs_file = (
+            f"{self._run_prefix(folder_name, run_id)}"
+            f"{partition_path}{_file_name(scope)}.parquet"
+        )
+        output = io.BytesIO()
+        encode_start = time.perf_counter()
+        pq.write_table(records_to_table(folder_name, records), output, compression="snappy")
+        upload_start = time.perf_counter()
+        self.bucket.blob(gcs_file).upload_from_string(
+            output.getvalue(),
+            content_type="application/octet-stream",
+            num_retries=3
+        )
+        self.metrics.record(
+            folder_name,
+            seconds=time.perf_counter() - upload_start,
+            uploads=1,
+            upload_bytes=output.tell(),
+            encode_seconds=upload_start - encode_start
+        )
+        return gcs_file
+
+
+    def upload_json(self, folder_name, records: Iterable[Dict], run_id: str,
+        scope: str = None) -> List[str]:
+        """
+        Upload records to GCS as newline delimited JSON in
+        the id/data landing format and return the GCS file paths.
+        """
+        return self.upload_lines(
+            folder_name,
+            (landing_line(record, record_course_id(folder_name, record)) for record in records),
+            run_id,
+            scope
+        )
+
+
+    def upload_lines(self, folder_name, lines: Iterable[bytes], run_id: str,
+        scope: str = None) -> List[str]:
+        """
+        Upload landing format lines to GCS as newline delimited
+        JSON and return the GCS file paths. Each run writes to
+        its own run id prefix inside the folder so readers keep
+        seeing the previous run until they are switched to the
+        new one with run_uri.
+
+        Lines may be any iterable, including a generator, and
+        are written into chunks of roughly chunk_size_bytes
+        that are gzip compressed and uploaded concurrently while
+        the next chunk is built.
 
-            gcs_paths.append(gcs_file)
+        File names start with scope, when passed, so the
+        files of one upload can be found with delete_upload.
+        """
+        gcs_paths = list()
+        record_count = 0
+        with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+            # bound the chunks held in memory to those being uploaded
+            uploads = deque()
+            chunk = io.BytesIO()
+            for line in lines:
+                chunk.write(line)
+                record_count += 1
+                if chunk.tell() >= self.chunk_size_bytes:
+                    uploads.append(executor.submit(
+                        self._upload_chunk, folder_name, run_id, scope, chunk.getvalue()))
+                    chunk = io.BytesIO()
+                    if len(uploads) >= self.upload_concurrency:
+                        gcs_paths.append(uploads.popleft().result())
+            if chunk.tell() > 0:
+                uploads.append(executor.submit(
+                    self._upload_chunk, folder_name, run_id, scope, chunk.getvalue()))
+            while uploads:
+                gcs_paths.append(uploads.popleft().result())
 
+        self.log.info(f"Uploaded {record_count} records in {len(gcs_paths)} chunks.")
         self.log.debug(gcs_paths)
         return gcs_paths
 
 
+    def folder_uri(self, folder_name: str) -> str:
+        """
+        Return a wildcard URI matching every
+        file in an endpoint folder.
+        """
+        return f"gs://{self.gcs_bucket}/{self.gcs_prefix}/{folder_name}/*"
+
+
+    def run_uri(self, folder_name: str, run_id: str) -> str:
+        """
+        Return a wildcard URI matching the files
+        a run wrote to an endpoint folder.
+        """
+        return f"gs://{self.gcs_bucket}/{self._run_prefix(folder_name, run_id)}*"
+
+
+    def folder_prefix_uri(self, folder_name: str) -> str:
+        """
+        Return the URI prefix hive partition
+        keys are parsed after.
+        """
+        return f"gs://{self.gcs_bucket}/{self.gcs_prefix}/{folder_name}/"
+
+
+    def _run_prefix(self, folder_name: str, run_id: str) -> str:
+        """
+        Return the object prefix a run writes an endpoint's
+        files under. The run id is written as a hive partition
+        so runs can share one partitioned table prefix.
+        """
+        return f"{self.gcs_prefix}/{folder_name}/run_id={run_id}/"
+
+
+    def delete_stale_runs(self, folder_name: str, run_id: str):
+        """
+        Delete every file in an endpoint folder that
+        was not written by the passed in run. Deletes are
+        sent in batched requests on a background thread
+        so they stay off the critical path.
+        """
+        run_prefix = self._run_prefix(folder_name, run_id)
+        blobs = [
+            blob for blob in self.bucket.list_blobs(prefix=f"{self.gcs_prefix}/{folder_name}/")
+            if not blob.name.startswith(run_prefix)
+        ]
+        if not blobs:
+            return
+
+        self.log.info(f"Deleting {len(blobs)} stale files from {folder_name} in the background.")
+        self._delete_in_background(blobs)
+
+
+    def delete_upload(self, folder_name: str, run_id: str, scope: str):
+        """
+        Delete the files a run uploaded to an endpoint
+        folder under a scope, such as those left by a
+        failed attempt of an upload that is run again.
+        """
+        blobs = [
+            blob for blob in self.bucket.list_blobs(prefix=self._run_prefix(folder_name, run_id))
+            if blob.name.rsplit("/", 1)[-1].startswith(f"{scope}-")
+        ]
+        if blobs:
+            self.log.info(f"Deleting {len(blobs)} {folder_name} files of an earlier {scope} upload.")
+            self._delete_blobs(blobs)
+
+
+    def _delete_in_background(self, blobs: List):
+        thread = threading.Thread(target=self._delete_blobs, args=(blobs,))
+        thread.start()
+        self.cleanup_threads.append(thread)
+
+
+    def _delete_blobs(self, blobs: List):
+        for i in range(0, len(blobs), DELETE_BATCH_SIZE):
+            with self.client.batch():
+                for blob in blobs[i:i+DELETE_BATCH_SIZE]:
+                    blob.delete()
+
+
+    def close(self):
+        """
+        Wait for background deletes to finish
+        and log the upload metrics.
+        """
+        for thread in self.cleanup_threads:
+            thread.join()
+        self.log.info(f"GCS upload metrics: {self.metrics.totals.summary()['endpoints']}")
+
+
+    def _upload_chunk(self, folder_name: str, run_id: str, scope: Optional[str],
+        data: bytes) -> str:
+        """
+        Upload newline delimited JSON bytes,
+        gzip compressed when configured, recording
+        the chunk's upload time and size.
+        """
+        extension = "json.gz" if self.compress else "json"
+        gcs_file = f"{self._run_prefix(folder_name, run_id)}{_file_name(scope)}.{extension}"
+        encode_start = time.perf_counter()
+        payload = gzip.compress(data) if self.compress else data
+        upload_start = time.perf_counter()
+        self.bucket.blob(gcs_file).upload_from_string(
+            payload,
+            content_type="application/json",
+            num_retries=3
+        )
+        self.metrics.record(
+            folder_name,
+            seconds=time.perf_counter() - upload_start,
+            uploads=1,
+            upload_bytes=len(payload),
+            encode_seconds=upload_start - encode_start
+        )
+        return gcs_file
+
+
+    def page_checkpoints(self, folder_name: str, run_id: str, scope: str) -> PageCheckpoints:
+        """
+        Return the page checkpoints of one op's
+        extract within a run, stored under the
+        _checkpoints folder.
+        """
+        return PageCheckpoints(
+            self.bucket, f"{self.gcs_prefix}/_checkpoints/{folder_name}/run_id={run_id}/{scope}/")
+
+
+    def delete_checkpoints(self, folder_name: str, run_id: str):
+        """
+        Delete the page checkpoints a run recorded for
+        an endpoint in the background once its extract has
+        been landed. Checkpoints of other runs are left for
+        them to resume from, so those of abandoned runs are
+        best expired with a lifecycle rule on _checkpoints.
+        """
+        blobs = list(self.bucket.list_blobs(
+            prefix=f"{self.gcs_prefix}/_checkpoints/{folder_name}/run_id={run_id}/"))
+        if blobs:
+            self._delete_in_background(blobs)
+
+
+    def read_state(self, name: str) -> Dict:
+        """
+        Return the JSON state document stored
+        under the _state folder, or an empty dict
+        if it has not been written yet.
+        """
+        from google.cloud import exceptions
+
+        blob = self.bucket.blob(f"{self.gcs_prefix}/_state/{name}.json")
+        try:
+            return json.loads(blob.download_as_bytes())
+        except exceptions.NotFound:
+            return dict()
+
+
+    def write_state(self, name: str, state: Dict) -> str:
+        """
+        Persist a JSON state document under
+        the _state folder and return its GCS path.
+        """
+        gcs_file = f"{self.gcs_prefix}/_state/{name}.json"
+        self.bucket.blob(gcs_file).upload_from_string(
+            json.dumps(state),
+            content_type="application/json",
+            num_retries=3
+        )
+        return f"gs://{self.gcs_bucket}/{gcs_file}"
+
+
 @resource(
     config_schema={
         "gcs_bucket": str,
         "gcs_prefix": str,
+        "compress": Field(bool, default_value=True,
+            description="Gzip compress newline delimited JSON uploads."),
+        "chunk_size_bytes": Field(int, default_value=64 * 1024 * 1024,
+            description="Uncompressed size of each uploaded JSON file."),
+        "upload_concurrency": Field(int, default_value=4,
+            description="Number of files uploaded concurrently."),
+        "landing_format": Field(
+            Enum("LandingFormat", [EnumValue("json"), EnumValue("parquet")]),
+            default_value="json",
+            description=(
+                "Land newline delimited JSON or typed, hive "
+                "partitioned parquet files."
+            )
+        )
     },
     description="Google Cloud Storage client",
 )
@@ -80,7 +513,15 @@ def gcs_client(context):
     """
     Initialize and return GcsClient()
     """
-    return GcsClient(
+    client = GcsClient(
         context.resource_config["gcs_bucket"],
-        context.resource_config["gcs_prefix"]
+        context.resource_config["gcs_prefix"],
+        compress=context.resource_config["compress"],
+        chunk_size_bytes=context.resource_config["chunk_size_bytes"],
+        upload_concurrency=context.resource_config["upload_concurrency"],
+        landing_format=context.resource_config["landing_format"]
     )
+    try:
+        yield client
+    finally:
+        client.close()
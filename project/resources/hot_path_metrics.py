@@ -0,0 +1,138 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from resources.canvas_cache import endpoint_name
+
+# number of the slowest courses included in a summary
+TOP_COURSES = 10
+
+
+def course_id_of(url: str) -> Optional[str]:
+    """
+    Return the course id in a course level
+    Canvas API URL, or None for account level URLs.
+    """
+    match = re.search(r"/courses/(\d+)", url)
+    return match.group(1) if match else None
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """
+    Return the nearest rank percentile of sorted values.
+    """
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+def record_retry(retry_state):
+    """
+    tenacity before_sleep callback recording the wait
+    before a client's page request is retried against
+    its metrics. The request's URL is its first argument.
+    """
+    client, url = retry_state.args[:2]
+    client.metrics.record_url(
+        url, retries=1, retry_wait_seconds=retry_state.next_action.sleep)
+
+
+class HotPathMetrics:
+    """
+    Thread safe collector of the timings and sizes of the
+    requests and uploads made by a client, by endpoint and
+    by course. Latencies are kept to summarise as p50, p95
+    and p99, everything else is summed into counters.
+
+    With keep_totals set, everything recorded is also kept
+    in totals, which drain does not reset, to summarise the
+    client's whole lifetime.
+    """
+
+    def __init__(self, keep_totals: bool = False):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.endpoints = defaultdict(lambda: defaultdict(float))
+        self.courses = defaultdict(lambda: defaultdict(float))
+        self.totals = HotPathMetrics() if keep_totals else None
+
+
+    def record(self, endpoint: str, course_id: str = None,
+        seconds: float = None, **counters: float):
+        """
+        Record a request or upload's latency and add
+        the passed in counters to its endpoint and course.
+        """
+        if self.totals is not None:
+            self.totals.record(endpoint, course_id, seconds, **counters)
+        with self.lock:
+            if seconds is not None:
+                self.latencies[endpoint].append(seconds)
+            for name, value in dict(counters, seconds=seconds or 0.0).items():
+                self.endpoints[endpoint][name] += value
+                if course_id is not None:
+                    self.courses[course_id][name] += value
+
+
+    def record_url(self, url: str, seconds: float = None, **counters: float):
+        """
+        Record against the endpoint and course of a URL.
+        """
+        self.record(endpoint_name(url), course_id_of(url), seconds, **counters)
+
+
+    @contextmanager
+    def timer(self, url: str, counter: str):
+        """
+        Add the time spent in the block to a
+        counter of the URL's endpoint and course.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_url(url, **{counter: time.perf_counter() - start})
+
+
+    def summary(self, top_courses: int = TOP_COURSES) -> Dict:
+        """
+        Return latency percentiles, in milliseconds, and
+        counters by endpoint, and the counters of the
+        courses that took the longest.
+        """
+        with self.lock:
+            endpoints = dict()
+            for endpoint, counters in sorted(self.endpoints.items()):
+                endpoints[endpoint] = {
+                    name: round(value, 3) for name, value in counters.items()}
+                latencies = sorted(self.latencies.get(endpoint, list()))
+                if latencies:
+                    for percent in (50, 95, 99):
+                        endpoints[endpoint][f"p{percent}_ms"] = round(
+                            _percentile(latencies, percent) * 1000, 1)
+
+            slowest = sorted(
+                self.courses.items(), key=lambda item: item[1].get("seconds", 0.0),
+                reverse=True)[:top_courses]
+            return {
+                "endpoints": endpoints,
+                "slowest_courses": {
+                    course_id: {name: round(value, 3) for name, value in counters.items()}
+                    for course_id, counters in slowest
+                }
+            }
+
+
+    def drain(self) -> Dict:
+        """
+        Return the summary and start collecting afresh,
+        so each op reports only its own requests.
+        """
+        summary = self.summary()
+        with self.lock:
+            self.latencies.clear()
+            self.endpoints.clear()
+            self.courses.clear()
+        return summary
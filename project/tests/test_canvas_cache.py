@@ -0,0 +1,44 @@
+import os
+
+from resources.canvas_cache import ResponseCache
+
+
+def _disk_bytes(cache: ResponseCache) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(cache.bodies_dir))
+
+
+def test_overwritten_bodies_are_reclaimed(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10000)
+    unchanged_urls = [f"https://canvas/api/v1/courses/{i}/sections" for i in range(5)]
+    changing_url = "https://canvas/api/v1/courses/99/submissions"
+
+    for url in unchanged_urls:
+        cache.put(url, {"ETag": url}, url.encode("utf-8") * 10)
+
+    hits = 0
+    for version in range(1000):
+        # a page whose body changes on every run
+        cache.put(changing_url, {"ETag": str(version)}, f"{version:0500d}".encode("utf-8"))
+        for url in unchanged_urls:
+            if cache.get(url) is not None:
+                hits += 1
+            else:
+                cache.put(url, {"ETag": url}, url.encode("utf-8") * 10)
+
+        assert _disk_bytes(cache) <= cache.max_bytes
+
+    # the unchanged pages stay cached while the changing page churns
+    assert hits == 1000 * len(unchanged_urls)
+    assert len(os.listdir(cache.bodies_dir)) <= len(unchanged_urls) + 20
+
+
+def test_shared_body_kept_until_last_entry_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10 ** 6)
+    cache.put("https://canvas/a", {"ETag": "1"}, b"same")
+    cache.put("https://canvas/b", {"ETag": "1"}, b"same")
+    cache.put("https://canvas/a", {"ETag": "2"}, b"changed")
+    cache.evict()
+
+    assert cache.get("https://canvas/b").body == b"same"
+    assert cache.get("https://canvas/a").body == b"changed"
+    assert len(os.listdir(cache.bodies_dir)) == 2
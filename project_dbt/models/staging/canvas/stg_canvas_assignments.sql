@@ -1,10 +1,24 @@
 
-SELECT
-    CAST(JSON_EXTRACT_SCALAR(data, '$.id') AS int64) AS id,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.course_id') AS int64) AS course_id,
-    JSON_EXTRACT_SCALAR(data, '$.name') AS name,
-    JSON_EXTRACT_SCALAR(data, '$.description') AS description,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.due_at') AS TIMESTAMP) AS due_at,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.points_possible') AS float64) AS points_possible,
-    JSON_EXTRACT_SCALAR(data, '$.workflow_state') AS workflow_state
-FROM {{ source('raw_sources', 'canvas_assignments') }}
+WITH assignments AS (
+    SELECT
+        CAST(JSON_EXTRACT_SCALAR(data, '$.id') AS int64) AS id,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.course_id') AS int64) AS course_id,
+        JSON_EXTRACT_SCALAR(data, '$.name') AS name,
+        JSON_EXTRACT_SCALAR(data, '$.description') AS description,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.due_at') AS TIMESTAMP) AS due_at,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.points_possible') AS float64) AS points_possible,
+        JSON_EXTRACT_SCALAR(data, '$.workflow_state') AS workflow_state,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.updated_at') AS TIMESTAMP) AS updated_at
+    FROM {{ source('raw_sources', 'canvas_assignments') }}
+)
+
+SELECT *
+FROM assignments
+WHERE
+{% if is_incremental() %}
+    updated_at >= (SELECT MAX(updated_at) FROM {{ this }})
+{% else %}
+    TRUE
+{% endif %}
+-- incremental extracts land a new copy of changed assignments
+QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY updated_at DESC) = 1
@@ -1,20 +1,47 @@
 
-SELECT
-    CAST(JSON_EXTRACT_SCALAR(data, '$.id') AS int64) AS id,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.assignment_id') AS int64) AS assignment_id,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.grading_period_id') AS int64) AS grading_period_id,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.user_id') AS int64) AS user_id,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.grader_id') AS int64) AS grader_id,
-    JSON_EXTRACT_SCALAR(data, '$.grade') AS grade,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.score') AS float64) AS score,
-    JSON_EXTRACT_SCALAR(data, '$.entered_grade') AS entered_grade,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.entered_score') AS float64) AS entered_score,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.submitted_at') AS TIMESTAMP) AS submitted_at,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.graded_at') AS TIMESTAMP) AS graded_at,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.posted_at') AS TIMESTAMP) AS posted_at,
-    JSON_EXTRACT_SCALAR(data, '$.submission_type') AS submission_type,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.grade_matches_current_submission') AS BOOL) AS grade_matches_current_submission,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.late') AS BOOL) AS late,
-    CAST(JSON_EXTRACT_SCALAR(data, '$.missing') AS BOOL) AS missing,
-    JSON_EXTRACT_SCALAR(data, '$.workflow_state') AS workflow_state
-FROM {{ source('raw_sources', 'canvas_submissions') }}
+WITH submissions AS (
+    SELECT
+        CAST(JSON_EXTRACT_SCALAR(data, '$.id') AS int64) AS id,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.assignment_id') AS int64) AS assignment_id,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.grading_period_id') AS int64) AS grading_period_id,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.user_id') AS int64) AS user_id,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.grader_id') AS int64) AS grader_id,
+        JSON_EXTRACT_SCALAR(data, '$.grade') AS grade,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.score') AS float64) AS score,
+        JSON_EXTRACT_SCALAR(data, '$.entered_grade') AS entered_grade,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.entered_score') AS float64) AS entered_score,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.submitted_at') AS TIMESTAMP) AS submitted_at,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.graded_at') AS TIMESTAMP) AS graded_at,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.posted_at') AS TIMESTAMP) AS posted_at,
+        JSON_EXTRACT_SCALAR(data, '$.submission_type') AS submission_type,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.grade_matches_current_submission') AS BOOL) AS grade_matches_current_submission,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.late') AS BOOL) AS late,
+        CAST(JSON_EXTRACT_SCALAR(data, '$.missing') AS BOOL) AS missing,
+        JSON_EXTRACT_SCALAR(data, '$.workflow_state') AS workflow_state,
+        COALESCE(
+            CAST(JSON_EXTRACT_SCALAR(data, '$.graded_at') AS TIMESTAMP),
+            CAST(JSON_EXTRACT_SCALAR(data, '$.submitted_at') AS TIMESTAMP)
+        ) AS updated_at,
+        -- written by the pipeline when the submission is extracted, so
+        -- every extracted row is merged whatever changed. Incremental
+        -- extracts only fetch submissions submitted or graded since the
+        -- last run, so a missing or late flag flipping on an unsubmitted
+        -- submission is only picked up by the next full extract
+        CAST(JSON_EXTRACT_SCALAR(data, '$._extracted_at') AS TIMESTAMP) AS extracted_at
+    FROM {{ source('raw_sources', 'canvas_submissions') }}
+)
+
+SELECT *
+FROM submissions
+WHERE
+{% if is_incremental() %}
+    extracted_at > (
+        SELECT COALESCE(MAX(extracted_at), TIMESTAMP '1970-01-01') FROM {{ this }}
+    )
+{% else %}
+    TRUE
+{% endif %}
+-- incremental extracts land a new copy of changed submissions
+QUALIFY ROW_NUMBER() OVER (
+    PARTITION BY id ORDER BY extracted_at DESC, updated_at DESC
+) = 1